@@ -1,3 +1,12 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Inspect queued and finished design jobs."""
+
+    list_display = ('id', 'status', 'priority', 'created', 'finished')
+    list_filter = ('status',)
+    readonly_fields = ('created', 'started', 'finished')
@@ -0,0 +1 @@
+"""Benchmarks of the design hot paths, run with ``manage.py benchmark``."""
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""A deterministic stand-in for primer3_core, for benchmarks.
+
+Reads Boulder-IO records from stdin (or a file given as the first
+argument) and writes an output record for each, in the same format and
+tag order as primer3_core. Global tags persist between records and
+sequence tags are reset after each one, as they are by primer3.
+
+Primer pairs are placed at random, seeded by the template, within the
+product size range, primer size range, SEQUENCE_PRIMER_PAIR_OK_REGION_LIST
+and SEQUENCE_TARGET of the record. Up to PRIMER_NUM_RETURN pairs are
+returned in order of penalty. No thermodynamics are involved, so this
+only exercises the code around primer3.
+
+Set FAKE_PRIMER3_NUM_RETURN to override PRIMER_NUM_RETURN for every
+record, and FAKE_PRIMER3_DELAY to a number of seconds to spend on each
+record, to model primer3's own cost.
+
+This module has no dependencies, so that it can be run as primer3_core.
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+
+DEFAULT_PRODUCT_SIZE = (100, 300)
+DEFAULT_PRIMER_SIZE = (18, 27)
+PRIMER_OPT_SIZE = 20
+COMPLEMENT = str.maketrans('ACGTN', 'TGCAN')
+# Attempts at placing a pair for each pair requested
+PLACEMENT_ATTEMPTS = 20
+
+
+def reverse_complement(sequence):
+    """Return the reverse complement of a DNA sequence."""
+    return sequence.translate(COMPLEMENT)[::-1]
+
+
+def melting_temperature(sequence):
+    """Return a rough Tm for an oligo from its GC content."""
+    gc = sum(base in 'GC' for base in sequence)
+    return 64.9 + 41 * (gc - 16.4) / len(sequence)
+
+
+def gc_percent(sequence):
+    """Return the GC content of a sequence as a percentage."""
+    return 100 * sum(base in 'GC' for base in sequence) / len(sequence)
+
+
+def int_pair(value, default):
+    """Return the first "a-b" or "a,b" pair of ints in a tag value."""
+    if not value:
+        return default
+    first = value.split()[0].replace('-', ',')
+    a, b = first.split(',')[:2]
+    return int(a), int(b)
+
+
+def ok_regions(tags, length):
+    """Return (left_start, left_end, right_start, right_end) regions."""
+    value = tags.get('SEQUENCE_PRIMER_PAIR_OK_REGION_LIST', '').strip()
+    if not value:
+        return [(0, length, 0, length)]
+    regions = []
+    for interval in value.split(';'):
+        ls, ll, rs, rl = [int(x) for x in interval.split(',')]
+        regions.append((ls, ls + ll, rs, rs + rl))
+    return regions
+
+
+def place_pairs(tags):
+    """Return (penalty, left_start, left_length, right_end, right_length).
+
+    Pairs are sorted by penalty and unique, and right_end is exclusive.
+    """
+    template = tags['SEQUENCE_TEMPLATE']
+    num_return = int(
+        os.environ.get('FAKE_PRIMER3_NUM_RETURN')
+        or tags.get('PRIMER_NUM_RETURN', 5)
+    )
+    amin, amax = int_pair(
+        tags.get('PRIMER_PRODUCT_SIZE_RANGE'), DEFAULT_PRODUCT_SIZE)
+    pmin = int(tags.get('PRIMER_MIN_SIZE', DEFAULT_PRIMER_SIZE[0]))
+    pmax = int(tags.get('PRIMER_MAX_SIZE', DEFAULT_PRIMER_SIZE[1]))
+    popt = int(tags.get('PRIMER_OPT_SIZE', PRIMER_OPT_SIZE))
+    target = tags.get('SEQUENCE_TARGET')
+    target = int_pair(target, None) if target else None
+    regions = ok_regions(tags, len(template))
+
+    rnd = random.Random(zlib.crc32(template.encode('ascii')))
+    pairs = {}
+    for _ in range(num_return * PLACEMENT_ATTEMPTS):
+        if len(pairs) >= num_return:
+            break
+        ls, le, rs, re = rnd.choice(regions)
+        left_length = rnd.randint(pmin, pmax)
+        right_length = rnd.randint(pmin, pmax)
+        if le - ls < left_length or re - rs < right_length:
+            continue
+        left_start = rnd.randint(ls, le - left_length)
+        first = max(rs + right_length, left_start + amin)
+        last = min(re, left_start + amax, len(template))
+        if first > last:
+            continue
+        right_end = rnd.randint(first, last)
+        if target and not (
+            left_start + left_length <= target[0]
+            and right_end >= sum(target)
+        ):
+            continue
+        if left_start + left_length > right_end - right_length:
+            continue
+        penalty = (
+            abs(left_length - popt)
+            + abs(right_length - popt)
+            + rnd.random()
+        )
+        key = (left_start, left_length, right_end, right_length)
+        pairs.setdefault(key, penalty)
+    return sorted((penalty,) + key for key, penalty in pairs.items())
+
+
+def primer_tags(side, i, sequence, position, length, penalty):
+    """Return output tags for one primer of a pair."""
+    return [
+        (f'PRIMER_{side}_{i}_PENALTY', f'{penalty:.6f}'),
+        (f'PRIMER_{side}_{i}_SEQUENCE', sequence),
+        (f'PRIMER_{side}_{i}', f'{position},{length}'),
+        (f'PRIMER_{side}_{i}_TM', f'{melting_temperature(sequence):.3f}'),
+        (f'PRIMER_{side}_{i}_GC_PERCENT', f'{gc_percent(sequence):.3f}'),
+        (f'PRIMER_{side}_{i}_SELF_ANY_TH', '0.00'),
+        (f'PRIMER_{side}_{i}_SELF_END_TH', '0.00'),
+        (f'PRIMER_{side}_{i}_HAIRPIN_TH', '0.00'),
+        (f'PRIMER_{side}_{i}_END_STABILITY', '3.0000'),
+    ]
+
+
+def design(tags):
+    """Return the output (tag, value) list for an input record."""
+    output = list(tags.items())
+    template = tags.get('SEQUENCE_TEMPLATE')
+    if not template:
+        return output + [('PRIMER_ERROR', 'Missing SEQUENCE tag')]
+    pairs = place_pairs(tags)
+    considered = len(template) * 10
+    output += [
+        ('PRIMER_LEFT_EXPLAIN', f'considered {considered}, ok {len(pairs)}'),
+        ('PRIMER_RIGHT_EXPLAIN', f'considered {considered}, ok {len(pairs)}'),
+        ('PRIMER_PAIR_EXPLAIN', f'considered {len(pairs)}, ok {len(pairs)}'),
+        ('PRIMER_LEFT_NUM_RETURNED', len(pairs)),
+        ('PRIMER_RIGHT_NUM_RETURNED', len(pairs)),
+        ('PRIMER_INTERNAL_NUM_RETURNED', 0),
+        ('PRIMER_PAIR_NUM_RETURNED', len(pairs)),
+    ]
+    for i, pair in enumerate(pairs):
+        penalty, left_start, left_length, right_end, right_length = pair
+        left = template[left_start:left_start + left_length]
+        right = reverse_complement(
+            template[right_end - right_length:right_end])
+        output.append((f'PRIMER_PAIR_{i}_PENALTY', f'{penalty:.6f}'))
+        output += primer_tags(
+            'LEFT', i, left, left_start, left_length, penalty / 2)
+        output += primer_tags(
+            'RIGHT', i, right, right_end - 1, right_length, penalty / 2)
+        output += [
+            (f'PRIMER_PAIR_{i}_COMPL_ANY_TH', '0.00'),
+            (f'PRIMER_PAIR_{i}_COMPL_END_TH', '0.00'),
+            (f'PRIMER_PAIR_{i}_PRODUCT_SIZE', right_end - left_start),
+        ]
+    return output
+
+
+def format_output(output):
+    """Return output tags as a Boulder-IO record."""
+    return ''.join(f'{k}={v}\n' for k, v in output) + '=\n'
+
+
+def main(stream, out=sys.stdout):
+    """Answer each record read from stream."""
+    delay = float(os.environ.get('FAKE_PRIMER3_DELAY') or 0)
+    tags = {}
+    for line in stream:
+        line = line.rstrip('\n')
+        if line != '=':
+            key, _, value = line.partition('=')
+            tags[key] = value
+            continue
+        if delay:
+            time.sleep(delay)
+        out.write(format_output(design(tags)))
+        out.flush()
+        tags = {k: v for k, v in tags.items() if not k.startswith('SEQUENCE_')}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            main(f)
+    else:
+        main(sys.stdin)
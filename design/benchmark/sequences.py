@@ -0,0 +1,35 @@
+"""Generate synthetic query sequences with a controlled probe site density."""
+
+import random
+from django.conf import settings
+
+from ..fasta import Fasta
+
+
+def synthetic_sequence(length, seed=0, site_density=2.0, probes=None, gc=0.5):
+    """Return a random DNA sequence seeded with probe sites.
+
+    site_density is the number of probe sites inserted per kb, drawn from
+    probes (by default the UPL library). Sites are placed at random and
+    may overlap, so the number of intact sites found may be a little lower.
+    """
+    rnd = random.Random(seed)
+    weights = [(1 - gc) / 2, gc / 2, gc / 2, (1 - gc) / 2]
+    sequence = rnd.choices('ACGT', weights=weights, k=length)
+    probes = list(probes or settings.UPL_PROBES.values())
+    for _ in range(round(length * site_density / 1000)):
+        probe = rnd.choice(probes)
+        if len(probe) > length:
+            break
+        start = rnd.randint(0, length - len(probe))
+        sequence[start:start + len(probe)] = probe
+    return ''.join(sequence)
+
+
+def synthetic_fasta(count, length, seed=0, site_density=2.0, probes=None):
+    """Return a FASTA string of count synthetic sequences."""
+    return str(Fasta({
+        f'synthetic_{i + 1}': synthetic_sequence(
+            length, seed + i, site_density, probes)
+        for i in range(count)
+    }))
@@ -0,0 +1,334 @@
+"""Time the design hot paths on synthetic sequences.
+
+Each case prepares its inputs from the run options and returns a callable
+that does the work to be timed. Cases that need primer3 output use the
+stand-in in fake_primer3, and the end-to-end case runs it in place of
+primer3_core, so no compiled primer3 is needed. Cases that can not run
+here, such as those needing NumPy without it installed, return None and
+are skipped.
+"""
+
+import io
+import os
+import json
+import atexit
+import shutil
+import timeit
+import tempfile
+import logging
+import platform
+import statistics
+from contextlib import contextmanager, redirect_stdout
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory, override_settings
+
+from .. import boulder, cache, parallel, ranking, specificity, views
+from ..fasta import Fasta
+from ..forms import PrimerForm
+from ..pool import get_pool
+from ..primer import AssayBuilder, Iteration, PrimerDesign, probe_filters
+from . import fake_primer3
+from .sequences import synthetic_fasta
+
+FAKE_PRIMER3_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'fake_primer3.py',
+)
+
+DEFAULT_OPTIONS = {
+    'sequences': 20,
+    'length': 2000,
+    'site_density': 2.0,
+    'num_return': 100,
+    'seed': 0,
+}
+
+# Contigs and their length (nt) of the synthetic reference genome, which
+# also holds the query sequences
+GENOME_CONTIGS = 10
+GENOME_CONTIG_LENGTH = 100000
+
+CASES = {}
+
+
+def case(func):
+    """Register a benchmark case under its function name."""
+    CASES[func.__name__] = func
+    return func
+
+
+def fasta_string(options):
+    """Return the synthetic FASTA input for the run options."""
+    return synthetic_fasta(
+        options['sequences'],
+        options['length'],
+        seed=options['seed'],
+        site_density=options['site_density'],
+    )
+
+
+def form_data(options):
+    """Return default form data for the synthetic FASTA input."""
+    data = {
+        name: field.initial
+        for name, field in PrimerForm.base_fields.items()
+        if field.initial is not None
+    }
+    data['fasta'] = fasta_string(options)
+    return data
+
+
+def design_params(options):
+    """Return cleaned design parameters for the synthetic input."""
+    form = PrimerForm(form_data(options))
+    with redirect_stdout(io.StringIO()):
+        if not form.is_valid():
+            raise ValueError(f'Invalid benchmark input: {form.errors}')
+    return form.cleaned_data
+
+
+def output_text(options):
+    """Return stand-in primer3 output for the synthetic input."""
+    params = design_params(options)
+    records = PrimerDesign(params, run=False).create_input(params)
+    return ''.join(
+        fake_primer3.format_output(fake_primer3.design(
+            dict(tags, PRIMER_NUM_RETURN=options['num_return'])))
+        for tags in records
+    )
+
+
+def iterations(options):
+    """Return (Iteration, record) for each synthetic output record."""
+    filters = probe_filters({})
+    lines = output_text(options).splitlines(True)
+    return [
+        (Iteration(record, filters), record)
+        for record in boulder.parse(lines)
+    ]
+
+
+def candidate_builders(iteration, record):
+    """Return an AssayBuilder for every primer pair of a record.
+
+    Probe matching is left to the caller.
+    """
+    return [
+        AssayBuilder(iteration, i, pair, iteration.sequence, probes=[])
+        for i, pair in enumerate(record.pairs)
+        if pair.get('LEFT_SEQUENCE')
+    ]
+
+
+@case
+def fasta_parse(options):
+    """Parse the FASTA input."""
+    string = fasta_string(options)
+    return lambda: Fasta.from_string(string)
+
+
+@case
+def output_parse(options):
+    """Parse primer3 output records."""
+    lines = output_text(options).splitlines(True)
+    return lambda: list(boulder.parse(lines))
+
+
+@case
+def iteration_parse(options):
+    """Build Iterations, with probe matching and ranking, from records."""
+    filters = probe_filters({})
+    records = list(boulder.parse(output_text(options).splitlines(True)))
+    return lambda: [Iteration(record, filters) for record in records]
+
+
+@case
+def get_probes(options):
+    """Match every primer pair to probe sites on its template."""
+    pairs = [
+        builder
+        for iteration, record in iterations(options)
+        for builder in candidate_builders(iteration, record)
+    ]
+
+    def run():
+        for builder in pairs:
+            builder.get_probes()
+    return run
+
+
+@case
+def ranking_offer(options):
+    """Rank the candidate assays of each sequence."""
+    candidates = []
+    for iteration, record in iterations(options):
+        candidates.append([
+            (builder, probe)
+            for builder in candidate_builders(iteration, record)
+            for probe in builder.get_probes()
+        ])
+    per_probe = probe_filters({})['assays_per_probe']
+
+    def run():
+        for offers in candidates:
+            ranker = ranking.Ranker(per_probe, settings.ASSAYS_PER_SEQUENCE)
+            for builder, probe in offers:
+                ranker.offer(builder, probe)
+            ranker.ranked()
+    return run
+
+
+@case
+def assay_render(options):
+    """Render the primer/probe alignment of every reported assay."""
+    assays = [
+        assay
+        for iteration, _ in iterations(options)
+        for assay in iteration.assays
+    ]
+    return lambda: [str(assay) for assay in assays]
+
+
+@case
+def index(options):
+    """Submit the design form and run the design in the request."""
+    factory = RequestFactory()
+    data = form_data(options)
+
+    def run():
+        # Every run must reach primer3 rather than the record cache
+        cache.records.clear()
+        with redirect_stdout(io.StringIO()):
+            response = views.index(factory.post('/', data))
+        assert response.status_code == 302, response.status_code
+    return run
+
+
+@case
+def off_target_screen(options):
+    """Screen every primer pair against a synthetic reference genome.
+
+    Pairs are screened with the index's caches bypassed.
+    """
+    if specificity.np is None:
+        return None
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    fasta = os.path.join(directory, 'genome.fa')
+    with open(fasta, 'w') as f:
+        f.write(synthetic_fasta(
+            GENOME_CONTIGS,
+            GENOME_CONTIG_LENGTH,
+            seed=options['seed'] + options['sequences'],
+            site_density=0,
+        ))
+        f.write(fasta_string(options))
+    specificity.build_index(fasta, directory)
+    index = specificity.GenomeIndex(directory)
+    pairs = [
+        (builder.left.sequence, builder.right.sequence, builder.amplicon_bp)
+        for iteration, record in iterations(options)
+        for builder in candidate_builders(iteration, record)
+    ]
+    return lambda: [index.count_off_targets(*pair) for pair in pairs]
+
+
+@contextmanager
+def environment():
+    """Run primer3 as the stand-in, against a throwaway database.
+
+    The persistent record cache is disabled and primer3 processes and
+    design workers are restarted, so that they pick up the stand-in.
+    Info logging is silenced, since it would otherwise be written for
+    every design run.
+    """
+    caches = dict(settings.CACHES, records={
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    })
+    with override_settings(PRIMER3_PATH=FAKE_PRIMER3_PATH, CACHES=caches):
+        get_pool().close()
+        parallel.reset_executor()
+        cache.records.clear()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        logging.disable(logging.INFO)
+        try:
+            yield
+        finally:
+            logging.disable(logging.NOTSET)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            get_pool().close()
+            parallel.reset_executor()
+            cache.records.clear()
+
+
+def measure(func, repeat):
+    """Return timings of func in seconds per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {
+        'number': number,
+        'repeat': repeat,
+        'best': min(times),
+        'median': statistics.median(times),
+    }
+
+
+def run(names=None, options=None, repeat=5, report=None):
+    """Run benchmark cases and return their timings by name.
+
+    report is called with the name and timings of each case as it ends.
+    """
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    results = {}
+    with environment():
+        for name in names or CASES:
+            func = CASES[name](options)
+            if func is None:
+                continue
+            timings = measure(func, repeat)
+            results[name] = timings
+            if report:
+                report(name, timings)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': options,
+        'results': results,
+    }
+
+
+def result_path(label):
+    """Return the path of the stored results for label."""
+    return os.path.join(settings.BENCHMARK_DIR, f'{label}.json')
+
+
+def save(label, data):
+    """Store the results of a run under label."""
+    os.makedirs(settings.BENCHMARK_DIR, exist_ok=True)
+    with open(result_path(label), 'w') as f:
+        json.dump(dict(data, label=label), f, indent=2)
+
+
+def load(label):
+    """Return the results stored under label."""
+    with open(result_path(label)) as f:
+        return json.load(f)
+
+
+def compare(baseline, data, threshold):
+    """Return (name, ratio, regressed) for cases timed in both runs.
+
+    ratio is the best time of this run over that of the baseline, and a
+    case has regressed if it is more than threshold slower.
+    """
+    rows = []
+    for name, timings in data['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        ratio = timings['best'] / before['best']
+        rows.append((name, ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,91 @@
+"""Read and write primer3 Boulder-IO records.
+
+For details on the input and output formats see:
+https://primer3.org/manual.html#inputAndOutputConventions
+"""
+
+RECORD_END = '='
+PAIR_TAGS = ('LEFT', 'RIGHT', 'PAIR', 'INTERNAL')
+
+
+class Record:
+    """A single Boulder-IO record with primer data grouped per pair.
+
+    Indexed tags such as ``PRIMER_LEFT_3_TM`` are stored on the pair at
+    index 3 under the key ``LEFT_TM``; ``PRIMER_LEFT_3`` itself is stored
+    as ``LEFT``. All other tags are kept in ``tags``.
+    """
+
+    def __init__(self, tags=None, pairs=None):
+        """Create record from tags dict and list of pair dicts."""
+        self.tags = tags or {}
+        self.pairs = pairs or []
+
+    def __getitem__(self, key):
+        """Return tag value."""
+        return self.tags[key]
+
+    def __contains__(self, key):
+        """Return True if tag is set."""
+        return key in self.tags
+
+    def get(self, key, default=None):
+        """Return tag value or default."""
+        return self.tags.get(key, default)
+
+    def renamed(self, name):
+        """Return a copy of the record with a new SEQUENCE_ID."""
+        return Record(dict(self.tags, SEQUENCE_ID=name), self.pairs)
+
+    def add(self, key, value):
+        """Add a single tag to the record."""
+        parts = key.split('_', 3)
+        if (
+            len(parts) > 2
+            and parts[0] == 'PRIMER'
+            and parts[1] in PAIR_TAGS
+            and parts[2].isdigit()
+        ):
+            ix = int(parts[2])
+            while len(self.pairs) <= ix:
+                self.pairs.append({})
+            name = parts[1] if len(parts) == 3 else f'{parts[1]}_{parts[3]}'
+            self.pairs[ix][name] = value
+        else:
+            self.tags[key] = value
+
+
+def parse(lines):
+    """Yield a Record as each record terminator is read from lines.
+
+    ``lines`` may be any iterable of text lines, such as a file object
+    reading from a pipe, so that records can be consumed while primer3 is
+    still running.
+    """
+    record = Record()
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line == RECORD_END:
+            yield record
+            record = Record()
+            continue
+        key, sep, value = line.partition('=')
+        if sep:
+            record.add(key, value)
+
+
+def format_record(tags):
+    """Return a Boulder-IO input record from a dict of tags."""
+    return ''.join(
+        f'{key}={value}\n'
+        for key, value in tags.items()
+        if value is not None
+    ) + RECORD_END + '\n'
+
+
+def tee(lines, file=None):
+    """Yield lines, copying them to file if given."""
+    for line in lines:
+        if file:
+            file.write(line)
+        yield line
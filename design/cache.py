@@ -0,0 +1,99 @@
+"""Cache primer3 output records per sequence and primer3 parameters.
+
+Only the raw primer3 output is cached, so that probe matching and ranking
+can be re-evaluated against stored primer pairs when just the probe
+filter settings change. When primer3 is restricted to the regions around
+probe sites, the probe library is part of the key.
+
+Records are looked up in a bounded in-process LRU tier first, then in the
+persistent ``records`` cache configured in settings.CACHES, which evicts
+entries by age (TIMEOUT) and count (MAX_ENTRIES).
+"""
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+import logging
+logger = logging.getLogger('django')
+
+# Bump to invalidate persisted entries when the cached objects change shape
+CACHE_VERSION = 3
+
+# Tags that identify the record rather than affect the result
+UNKEYED_TAGS = (
+    'SEQUENCE_ID',
+    'PRIMER_THERMODYNAMIC_PARAMETERS_PATH',
+)
+
+
+def cache_key(plan, **options):
+    """Return a content hash of the (offset, tags) records run for a query.
+
+    Any options that decide how the records are run are hashed with them.
+    """
+    keyed = [
+        (offset, {
+            k: str(v) for k, v in tags.items()
+            if k not in UNKEYED_TAGS
+        })
+        for offset, tags in plan
+    ]
+    data = json.dumps([keyed, options], sort_keys=True).encode('utf-8')
+    return f'design:{CACHE_VERSION}:' + hashlib.sha256(data).hexdigest()
+
+
+class RecordCache:
+    """Two-tier cache of primer3 output records."""
+
+    def __init__(self, size, alias='records'):
+        """Create cache with an LRU tier of the given number of entries."""
+        self.size = size
+        self.alias = alias
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value or None."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        try:
+            value = caches[self.alias].get(key)
+        except Exception as exc:
+            logger.warning(f'Result cache read failed: {exc}')
+            return None
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """Store value in both tiers."""
+        self._remember(key, value)
+        try:
+            caches[self.alias].set(key, value)
+        except Exception as exc:
+            logger.warning(f'Result cache write failed: {exc}')
+
+    def _remember(self, key, value):
+        """Store value in the in-process tier, evicting the oldest entry."""
+        if not self.size:
+            return
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.size:
+                self.memory.popitem(last=False)
+
+    def clear(self):
+        """Empty both tiers."""
+        with self.lock:
+            self.memory.clear()
+        caches[self.alias].clear()
+
+
+records = RecordCache(settings.RECORD_CACHE_SIZE)
@@ -0,0 +1,108 @@
+"""Bound the time a design run may take, and let it be cancelled."""
+
+import os
+import time
+import threading
+import multiprocessing
+
+# Seconds between checks of a cancellation callback
+CANCEL_POLL_INTERVAL = 1
+
+_manager = None
+_manager_pid = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Return the manager of flags shared with worker processes."""
+    global _manager, _manager_pid
+    with _manager_lock:
+        if _manager is None or _manager_pid != os.getpid():
+            # Not forked, for the same reason as parallel.get_executor()
+            _manager = multiprocessing.get_context('forkserver').Manager()
+            _manager_pid = os.getpid()
+        return _manager
+
+
+class DesignStopped(Exception):
+    """Raised when a design run passes its deadline or is cancelled.
+
+    The reason is either 'deadline' or 'cancelled'.
+    """
+
+    def __init__(self, reason, message):
+        """Create exception with a reason code and message."""
+        super().__init__(message)
+        self.reason = reason
+
+    def __reduce__(self):
+        """Pickle with the reason, to be raised again from worker processes."""
+        return self.__class__, (self.reason, str(self))
+
+
+class Deadline:
+    """The time limit and cancellation state of a design run.
+
+    ``cancelled`` is an optional callable returning True once the run has
+    been cancelled. It is polled at most once per CANCEL_POLL_INTERVAL and
+    is not carried over when the deadline is pickled for worker processes.
+    Once share() has been called, copies pickled for worker processes poll
+    a flag instead, which is set when the callback first returns True.
+    """
+
+    def __init__(self, seconds=None, cancelled=None):
+        """Start the clock on a run of up to the given seconds."""
+        self.seconds = seconds
+        self.expires = time.time() + seconds if seconds else None
+        self.cancelled = cancelled
+        # Event shared with worker processes, set once cancelled
+        self.stop = None
+        self.last_poll = 0
+
+    def __getstate__(self):
+        """Drop the cancellation callback when pickling."""
+        state = self.__dict__.copy()
+        state['cancelled'] = None
+        return state
+
+    def share(self):
+        """Let copies pickled for worker processes see a cancellation."""
+        if self.cancelled is not None and self.stop is None:
+            self.stop = get_manager().Event()
+
+    def remaining(self):
+        """Return seconds left before the deadline, or None if unbounded."""
+        if self.expires is None:
+            return None
+        return max(0, self.expires - time.time())
+
+    def timeout(self, limit=None):
+        """Return the lesser of limit and the remaining time, or None."""
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if limit is None:
+            return remaining
+        return min(limit, remaining)
+
+    def check(self):
+        """Raise DesignStopped if the deadline has passed or on cancel."""
+        now = time.time()
+        if self.expires is not None and now >= self.expires:
+            raise DesignStopped(
+                'deadline',
+                f'Design run exceeded its deadline of {self.seconds}s',
+            )
+        if self.cancelled is None and self.stop is None:
+            return
+        if now - self.last_poll < CANCEL_POLL_INTERVAL:
+            return
+        self.last_poll = now
+        if self.cancelled is None:
+            cancelled = self.stop.is_set()
+        else:
+            cancelled = self.cancelled()
+            if cancelled and self.stop is not None:
+                self.stop.set()
+        if cancelled:
+            raise DesignStopped('cancelled', 'Design run was cancelled')
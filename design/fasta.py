@@ -1,23 +1,31 @@
 """Read fasta sequence string into a useful object."""
 
+import re
+import codecs
 from django.core.exceptions import ValidationError
 
 import logging
 logger = logging.getLogger('django')
 
-DNA = {'A', 'T', 'G', 'C'}
+INVALID_DNA = re.compile('[^ATGC]')
+ANONYMOUS = "Anonymous sequence"
+LINE_WIDTH = 80
+CHUNK_SIZE = 64 * 1024
 
 
 def valid_dna(sequence, title):
     """Assert that sequence string is valid DNA."""
-    if len(set(sequence) - DNA):
-        invalid = list(set(sequence) - DNA)[0]
-        position = sequence.index(invalid) + 1
+    match = INVALID_DNA.search(sequence)
+    if match:
+        invalid = match.group()
+        position = match.start() + 1
         msg = (
             f'Sequence "{title}": Invalid DNA residue "{invalid}"'
             + f' at position {position}'
         )
-        logger.info(f"FASTA failed form validation:\n{msg}")
+        logger.info(
+            'FASTA failed form validation: %s', msg,
+            extra={'sample': 'invalid-fasta'})
         raise ValidationError({'fasta': msg})
     return True
 
@@ -35,14 +43,10 @@ class Fasta:
         writeList = []
 
         for title, sequence in self.items():
-            seqList = []
-            while True:
-                if len(sequence) >= 80:
-                    seqList.append(sequence[0:80])
-                    sequence = sequence[80:]
-                else:
-                    seqList.append(sequence)
-                    break
+            seqList = [
+                sequence[i:i + LINE_WIDTH]
+                for i in range(0, len(sequence), LINE_WIDTH)
+            ] or ['']
             writeList.append('>' + title + '\n' + '\n'.join(seqList))
 
         return '\n'.join(writeList)
@@ -83,44 +87,104 @@ class Fasta:
     @classmethod
     def from_string(Cls, string):
         """Read in from string and parse to dict."""
-        seq = ""
-        title = ""
-        fas = {}
-        copy = False
-
-        if '>' not in string:
-            # Not FASTA formatted. Parse as single sequence.
-            title = "Anonymous sequence"
-            seq = (
-                string.replace(' ', '')
-                .replace('\n', '')
-                .replace('\r', '')
-                .upper()
-            )
-            if valid_dna(seq, title):
-                fas[title] = seq
-                return Cls(fas)
-
-        for line in string.split('\n'):
-            if line.startswith('>'):
-                if copy and valid_dna(seq, title):
-                    fas[title] = seq
-                title = line.strip(">\n\r ").replace(' ', '_')
-                copy = True
-                seq = ""
-            else:
-                line = line.strip("\n\r ")
-                seq += line.upper()
-
-        # Ensure duplicate fasta titles don't get overwritten
-        i = 1
-        while f'{title}_{i}' in fas.keys():
-            title = f'{title}_{i}'
-            i += 1
-        fas[title] = seq
+        return Cls.from_records(read_records(string.split('\n')))
+
+    @classmethod
+    def from_file(Cls, f, chunk_size=CHUNK_SIZE):
+        """Read in from a text or binary file object, one chunk at a time.
+
+        Accepts Django uploaded files, which are read with ``chunks()`` so
+        that large uploads are never held in memory as a single string.
+        """
+        if hasattr(f, 'chunks'):
+            chunks = f.chunks(chunk_size)
+        else:
+            chunks = read_chunks(f, chunk_size)
+        return Cls.from_records(read_records(iter_lines(chunks)))
 
+    @classmethod
+    def from_records(Cls, records):
+        """Create from (title, sequence) tuples, renaming duplicate titles."""
+        fas = {}
+        for title, seq in records:
+            # Ensure duplicate fasta titles don't get overwritten
+            i = 1
+            unique = title
+            while unique in fas:
+                unique = f'{title}_{i}'
+                i += 1
+            fas[unique] = seq
         return Cls(fas)
 
+
+def read_chunks(f, chunk_size):
+    """Yield chunks read from a text or binary file until it is empty."""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_lines(chunks):
+    """Yield text lines from an iterable of str or bytes chunks.
+
+    The pieces of a line spanning several chunks are joined once, so long
+    unwrapped lines are read in linear time.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pieces = []
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if not chunk:
+            continue
+        lines = chunk.split('\n')
+        if len(lines) == 1:
+            pieces.append(chunk)
+            continue
+        pieces.append(lines[0])
+        yield ''.join(pieces)
+        yield from lines[1:-1]
+        pieces = [lines[-1]]
+    pieces.append(decoder.decode(b'', final=True))
+    partial = ''.join(pieces)
+    if partial:
+        yield partial
+
+
+def read_records(lines):
+    """Yield validated (title, sequence) tuples from FASTA lines.
+
+    Each record is validated as soon as it is complete and sequence lines
+    are joined once, so parsing is linear in the input size. Input with no
+    FASTA header is read as a single anonymous sequence.
+    """
+    title = None
+    seq = []
+    for line in lines:
+        if line.startswith('>'):
+            if title is not None:
+                yield validated(title, seq)
+            title = line.strip(">\n\r ").replace(' ', '_')
+            seq = []
+        else:
+            seq.append(line.strip("\n\r ").upper())
+
+    if title is None:
+        # Not FASTA formatted. Parse as single sequence.
+        title = ANONYMOUS
+        seq = [line.replace(' ', '') for line in seq]
+    yield validated(title, seq)
+
+
+def validated(title, lines):
+    """Return (title, sequence) from sequence lines if valid DNA."""
+    sequence = ''.join(lines)
+    valid_dna(sequence, title)
+    return title, sequence
+
+
 if __name__ == '__main__':
     fasta_str = (
         'CACGGCATCGTCACCAACTGGGACGACATGGAGAAAATCTGGCACCACACCTTCTACAATGAGCTGCGTGTGGCTCCCGA\r\n'
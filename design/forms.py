@@ -5,6 +5,7 @@ https://primer3.org/manual.html#globalTags
 """
 
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
 from .fasta import Fasta
@@ -13,7 +14,8 @@ from .fasta import Fasta
 class PrimerForm(forms.Form):
     """Collect user input to run primer prediction."""
 
-    fasta = forms.CharField(initial="")
+    fasta = forms.CharField(initial="", required=False)
+    fasta_file = forms.FileField(required=False)
     # Primer size range
     primer_min = forms.IntegerField(initial=18, max_value=35)
     primer_max = forms.IntegerField(initial=27, max_value=35)
@@ -36,11 +38,45 @@ class PrimerForm(forms.Form):
     # GC content
     gc_min = forms.FloatField(initial=20.0, min_value=0, max_value=100)
     gc_clamp = forms.IntegerField(initial=0)
+    # Split long sequences into overlapping windows
+    tiling = forms.BooleanField(required=False, initial=False)
+    # Design primers generically, or around each probe site
+    mode = forms.ChoiceField(
+        required=False,
+        initial='generic',
+        choices=[
+            ('generic', 'Generic primers, then match probes'),
+            ('probe', 'Target probe sites'),
+        ],
+    )
+    # Probe matching. Unless primer3 is restricted to probe site regions,
+    # these only filter primer3 output and re-use cached primer3 results.
+    probe_library = forms.ChoiceField(
+        required=False,
+        initial=settings.DEFAULT_PROBE_LIBRARY,
+        choices=[
+            (key, library['name'])
+            for key, library in settings.PROBE_LIBRARIES.items()
+        ],
+    )
+    probe_distance = forms.IntegerField(
+        required=False, initial=settings.MIN_PROBE_DISTANCE,
+        min_value=0, max_value=1000)
+    assays_per_probe = forms.IntegerField(
+        required=False, initial=settings.ASSAYS_PER_PROBE,
+        min_value=1, max_value=100)
 
     def clean(self):
         """Validate and return user input."""
         data = self.cleaned_data
-        data['fasta'] = Fasta.from_string(data['fasta'])
+        upload = data.pop('fasta_file', None)
+        if upload:
+            data['fasta'] = Fasta.from_file(upload)
+        elif data.get('fasta'):
+            data['fasta'] = Fasta.from_string(data['fasta'])
+        else:
+            raise ValidationError({
+                'fasta': 'Enter FASTA sequence(s) or upload a FASTA file'})
         validate_fasta(data)
         return data
 
@@ -0,0 +1,133 @@
+"""Time the design hot paths and compare them against stored results."""
+
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from design.benchmark import suite
+
+
+def default_label():
+    """Return the current git revision, or a timestamp outside of git."""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--tags', '--always', '--dirty'],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return timezone.now().strftime('%Y%m%d-%H%M%S')
+
+
+class Command(BaseCommand):
+    """Run the benchmark suite."""
+
+    help = (
+        'Time the design hot paths on synthetic sequences, using a'
+        ' stand-in for primer3_core, and store the results under'
+        ' settings.BENCHMARK_DIR.'
+    )
+
+    def add_arguments(self, parser):
+        """Add command line arguments."""
+        parser.add_argument(
+            'cases',
+            nargs='*',
+            help='Cases to run: ' + ', '.join(suite.CASES)
+                 + '. All cases are run by default.',
+        )
+        parser.add_argument(
+            '--label',
+            help='Name to store the results under. Defaults to the git'
+                 ' revision.',
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='LABEL',
+            help='Stored results to compare against.',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.1,
+            help='Fraction slower than the compared results at which a'
+                 ' case is reported as a regression.',
+        )
+        parser.add_argument(
+            '--no-save',
+            action='store_true',
+            help='Do not store the results.',
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        defaults = suite.DEFAULT_OPTIONS
+        parser.add_argument(
+            '--sequences', type=int, default=defaults['sequences'],
+            help='Number of synthetic query sequences.')
+        parser.add_argument(
+            '--length', type=int, default=defaults['length'],
+            help='Length (nt) of each synthetic sequence.')
+        parser.add_argument(
+            '--site-density', type=float, default=defaults['site_density'],
+            help='Probe sites inserted per kb of synthetic sequence.')
+        parser.add_argument(
+            '--num-return', type=int, default=defaults['num_return'],
+            help='Primer pairs returned per record by the primer3 stand-in.')
+        parser.add_argument(
+            '--seed', type=int, default=defaults['seed'])
+
+    def handle(self, *args, **options):
+        """Run the cases, then store and compare the results."""
+        unknown = set(options['cases']) - set(suite.CASES)
+        if unknown:
+            raise CommandError(f'Unknown cases: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = suite.load(options['compare'])
+            except FileNotFoundError:
+                raise CommandError(
+                    f'No stored results for "{options["compare"]}"')
+
+        def report(name, timings):
+            self.stdout.write(
+                f'{name:<20} {timings["best"] * 1000:>10.3f} ms'
+                f'  (median {timings["median"] * 1000:.3f} ms,'
+                f' {timings["number"]} x {timings["repeat"]})'
+            )
+
+        data = suite.run(
+            names=options['cases'],
+            options={
+                name: options[name]
+                for name in suite.DEFAULT_OPTIONS
+            },
+            repeat=options['repeat'],
+            report=report,
+        )
+
+        if not options['no_save']:
+            label = options['label'] or default_label()
+            suite.save(label, data)
+            self.stdout.write(f'Results stored as "{label}"')
+
+        if baseline is None:
+            return
+        if baseline['options'] != data['options']:
+            self.stdout.write(self.style.WARNING(
+                'Options differ from the compared results:'
+                f' {baseline["options"]}'))
+        regressions = []
+        for name, ratio, regressed in suite.compare(
+                baseline, data, options['threshold']):
+            line = f'{name:<20} {ratio:>6.2f}x'
+            if regressed:
+                regressions.append(name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'Slower than "{baseline["label"]}": '
+                + ', '.join(regressions))
@@ -0,0 +1,53 @@
+"""Build the reference genome index used for specificity screening."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from design import specificity
+
+
+class Command(BaseCommand):
+    """Index a reference FASTA for off-target screening."""
+
+    help = (
+        'Index the genome of a reference FASTA file, which may be gzipped,'
+        ' for screening assays for off-target amplicons. Set'
+        ' settings.SPECIFICITY_INDEX to the output directory to enable'
+        ' screening.'
+    )
+
+    def add_arguments(self, parser):
+        """Add command line arguments."""
+        parser.add_argument('fasta', help='Reference genome FASTA file.')
+        parser.add_argument(
+            '--output',
+            default=settings.SPECIFICITY_INDEX,
+            help='Directory to write the index to. Defaults to'
+                 ' settings.SPECIFICITY_INDEX.',
+        )
+        parser.add_argument(
+            '--seed-length',
+            type=int,
+            default=settings.SPECIFICITY_SEED_LENGTH,
+            help="Bases at the 3' end of primers that must match exactly.",
+        )
+
+    def handle(self, *args, **options):
+        """Build the index."""
+        if specificity.np is None:
+            raise CommandError('NumPy is required to build the index')
+        if not options['output']:
+            raise CommandError(
+                'Give --output or set settings.SPECIFICITY_INDEX')
+        if not 8 <= options['seed_length'] <= 14:
+            raise CommandError('--seed-length must be from 8 to 14')
+        try:
+            total = specificity.build_index(
+                options['fasta'],
+                options['output'],
+                options['seed_length'],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        self.stdout.write(
+            f"Indexed {total} seeds to {options['output']}")
@@ -0,0 +1,100 @@
+"""Drain the design job queue in background worker processes."""
+
+import os
+import time
+import signal
+import multiprocessing
+from contextlib import nullcontext
+from django import db
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from design import profiling
+from design.models import Job
+
+import logging
+logger = logging.getLogger('django')
+
+
+def work(poll_interval, stop, parent_pid):
+    """Run queued jobs until stop is set or the parent exits."""
+    # Leave interrupts to the parent so that running jobs can finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while not stop.is_set() and os.getppid() == parent_pid:
+        job = Job.claim_next()
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        logger.info(f'Running job {job.id}')
+        with (
+            profiling.profile(f'job {job.id}') if job.profile
+            else nullcontext()
+        ):
+            job.run()
+
+
+class Command(BaseCommand):
+    """Run design jobs from the queue."""
+
+    help = 'Run queued primer design jobs in background worker processes.'
+
+    def add_arguments(self, parser):
+        """Add command line arguments."""
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.JOB_CONCURRENCY,
+            help='Number of jobs to run at once.',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help='Seconds to wait between polls of an empty queue.',
+        )
+
+    def handle(self, *args, **options):
+        """Start workers and purge expired jobs until interrupted."""
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        # Each worker must open its own database connection
+        db.connections.close_all()
+        workers = [
+            context.Process(
+                target=work,
+                args=(options['poll_interval'], stop, os.getpid()),
+            )
+            for _ in range(options['concurrency'])
+        ]
+        for worker in workers:
+            worker.start()
+
+        interrupted = []
+
+        def shutdown(signum, frame):
+            interrupted.append(signum)
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        self.stdout.write(
+            f'Started {len(workers)} design workers.'
+            ' Waiting for jobs...')
+
+        while not interrupted:
+            Job.clean_up()
+            for i, worker in enumerate(workers):
+                if not worker.is_alive():
+                    logger.warning('Restarting dead design worker')
+                    db.connections.close_all()
+                    workers[i] = context.Process(
+                        target=work,
+                        args=(options['poll_interval'], stop, os.getpid()),
+                    )
+                    workers[i].start()
+            time.sleep(options['poll_interval'] * 10)
+
+        self.stdout.write('Stopping design workers...')
+        stop.set()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,222 @@
+"""Match probe libraries against DNA sequences in a single pass.
+
+Probe sequences from both strands are compiled into an Aho-Corasick
+automaton once per library, so that scanning an amplicon costs time
+proportional to its length and the number of hits rather than the size of
+the probe library.
+"""
+
+import json
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+
+from django.conf import settings
+
+COMPLEMENT = {
+    'A': 'T',
+    'T': 'A',
+    'G': 'C',
+    'C': 'G',
+}
+
+FORWARD = '+'
+REVERSE = '-'
+
+# A single probe site. ``count`` is the number of non-overlapping sites of
+# the same probe/strand in the scanned sequence, as given by ``str.count``.
+ProbeHit = namedtuple(
+    'ProbeHit',
+    ['id', 'strand', 'sequence', 'offset', 'count', 'order'],
+)
+
+
+def reverse_complement(sequence):
+    """Return reverse complement of sequence."""
+    return ''.join([
+        COMPLEMENT[nt] for nt in sequence[::-1].upper()
+    ])
+
+
+def count_sites(offsets, length):
+    """Count non-overlapping sites from a sorted list of hit offsets."""
+    count = 0
+    next_free = None
+    for offset in offsets:
+        if next_free is None or offset >= next_free:
+            count += 1
+            next_free = offset + length
+    return count
+
+
+class ProbeMatcher:
+    """Aho-Corasick automaton over both strands of a probe library."""
+
+    def __init__(self, probes):
+        """Build the automaton from a dict of {probe_id: sequence}."""
+        self.probes = probes
+        # Each pattern is (probe_id, strand, sequence). The pattern index
+        # preserves library order so that results are reported in the same
+        # order as iterating over the library.
+        self.patterns = []
+        for probe_id, probe_seq in probes.items():
+            probe_seq = probe_seq.upper()
+            self.patterns.append((probe_id, FORWARD, probe_seq))
+            self.patterns.append(
+                (probe_id, REVERSE, reverse_complement(probe_seq)))
+        self._build()
+
+    def __len__(self):
+        """Return number of patterns (probes x strands)."""
+        return len(self.patterns)
+
+    def _build(self):
+        """Construct goto, failure and output tables."""
+        goto = [{}]
+        outputs = [[]]
+        for ix, (_, _, sequence) in enumerate(self.patterns):
+            node = 0
+            for nt in sequence:
+                nxt = goto[node].get(nt)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][nt] = nxt
+                    goto.append({})
+                    outputs.append([])
+                node = nxt
+            outputs[node].append(ix)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for nt, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and nt not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(nt, 0)
+                if fail[child] == child:
+                    fail[child] = 0
+                outputs[child] = outputs[child] + outputs[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(x) for x in outputs]
+
+    def scan(self, sequence, start=0, end=None):
+        """Yield (pattern_index, offset) for every site in sequence[start:end].
+
+        Overlapping sites are all reported, ordered by their end position.
+        """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        patterns = self.patterns
+        node = 0
+        end = len(sequence) if end is None else end
+        for i in range(start, end):
+            nt = sequence[i]
+            while node and nt not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(nt, 0)
+            for ix in outputs[node]:
+                yield ix, i - len(patterns[ix][2]) + 1
+
+
+class ProbeSiteIndex:
+    """Sorted position index of every probe site in a template sequence.
+
+    The template is scanned once, after which the probe sites falling
+    inside any region of the template can be found with bisect range
+    queries.
+    """
+
+    def __init__(self, matcher, sequence):
+        """Scan sequence for probe sites and index them by position."""
+        self.matcher = matcher
+        sites = sorted(
+            (offset, ix)
+            for ix, offset in matcher.scan(sequence)
+        )
+        self.offsets = [offset for offset, _ in sites]
+        self.patterns = [ix for _, ix in sites]
+        self.sites = {}
+        for offset, ix in sites:
+            self.sites.setdefault(ix, []).append(offset)
+        self.min_length = min(
+            [len(x[2]) for x in matcher.patterns] or [0])
+
+    def __len__(self):
+        """Return number of probe sites in the template."""
+        return len(self.offsets)
+
+    def spans(self):
+        """Return (start, end) of every probe site, ordered by start."""
+        return [
+            (offset, offset + len(self.matcher.patterns[ix][2]))
+            for offset, ix in zip(self.offsets, self.patterns)
+        ]
+
+    def within(self, start, end):
+        """Return hits for probes lying wholly inside template[start:end].
+
+        Offsets are absolute template positions. Counts are the number of
+        non-overlapping sites of each probe/strand inside the region.
+        """
+        lo = bisect_left(self.offsets, start)
+        hi = bisect_right(self.offsets, end - self.min_length)
+        first = {}
+        for i in range(lo, hi):
+            ix = self.patterns[i]
+            if ix in first:
+                continue
+            if self.offsets[i] + len(self.matcher.patterns[ix][2]) <= end:
+                first[ix] = self.offsets[i]
+
+        hits = []
+        for ix in sorted(first):
+            probe_id, strand, probe_seq = self.matcher.patterns[ix]
+            length = len(probe_seq)
+            sites = self.sites[ix]
+            site_lo = bisect_left(sites, first[ix])
+            site_hi = bisect_right(sites, end - length)
+            hits.append(ProbeHit(
+                probe_id,
+                strand,
+                probe_seq,
+                first[ix],
+                count_sites(sites[site_lo:site_hi], length),
+                ix,
+            ))
+        return hits
+
+
+_libraries = {}
+_matchers = {}
+
+
+def get_library(name=None):
+    """Return the {probe_id: sequence} dict of a configured probe library.
+
+    Defaults to settings.DEFAULT_PROBE_LIBRARY.
+    """
+    name = name or settings.DEFAULT_PROBE_LIBRARY
+    if name not in _libraries:
+        with open(settings.PROBE_LIBRARIES[name]['path']) as f:
+            _libraries[name] = json.load(f)
+    return _libraries[name]
+
+
+def get_matcher(probes=None):
+    """Return a cached matcher for the given probe library.
+
+    Defaults to settings.DEFAULT_PROBE_LIBRARY.
+    """
+    if probes is None:
+        probes = get_library()
+    key = id(probes)
+    cached = _matchers.get(key)
+    if cached is None or cached.probes is not probes:
+        cached = ProbeMatcher(probes)
+        _matchers[key] = cached
+    return cached
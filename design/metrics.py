@@ -0,0 +1,298 @@
+"""Time the stages of design runs and count the work done.
+
+Stage timings are collected per request by TimingMiddleware, returned to
+the client in a ``Server-Timing`` header and observed in histograms.
+Counters of records, primer pairs and assays are kept as results are
+produced. Both are served in the Prometheus text format by the
+``/metrics`` view.
+
+Metrics are held in memory per server process. Records designed in
+parallel worker processes report their stage timings back with each
+Iteration. Jobs run by ``design_worker`` store their stage timings and
+counts on the Job, and are added to the metrics of the first server
+process to serve ``/metrics`` after they finish.
+"""
+
+import time
+import bisect
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from django.http import StreamingHttpResponse
+
+# Design run stages, in the order they occur
+STAGES = ('input', 'cache', 'primer3', 'parse', 'match', 'store', 'render')
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+
+
+class Counter:
+    """A monotonically increasing count."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        """Create counter with a Prometheus metric name and help text."""
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the count."""
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        """Yield (name, labels, value) samples."""
+        yield self.name, {}, self.value
+
+
+class Histogram:
+    """Counts of observed values in cumulative buckets, per label value."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        """Create histogram with a single label."""
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        """Record an observed value."""
+        with self.lock:
+            counts, total = self.series.get(
+                label_value, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.series[label_value] = (counts, total + value)
+
+    def samples(self):
+        """Yield (name, labels, value) samples."""
+        with self.lock:
+            series = sorted(
+                (k, list(counts), total)
+                for k, (counts, total) in self.series.items()
+            )
+        for label_value, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield self.name + '_bucket', {
+                    self.label: label_value,
+                    'le': str(bound),
+                }, cumulative
+            yield self.name + '_sum', {self.label: label_value}, total
+            yield self.name + '_count', {self.label: label_value}, cumulative
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self):
+        """Create empty registry."""
+        self.metrics = []
+        self.names = {}
+
+    def register(self, metric):
+        """Add a metric and return it."""
+        self.metrics.append(metric)
+        self.names[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        """Return the metric of the given name."""
+        return self.names[name]
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{' + ','.join(
+                        f'{k}="{v}"' for k, v in labels.items()) + '}'
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+STAGE_SECONDS = registry.register(Histogram(
+    'primerdesign_stage_seconds',
+    'Time spent in each design stage per request or job.',
+    'stage',
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'primerdesign_request_seconds',
+    'Time taken to respond to requests, per view.',
+    'view',
+))
+RECORDS = registry.register(Counter(
+    'primerdesign_records_total',
+    'Query sequences designed.',
+))
+PAIRS = registry.register(Counter(
+    'primerdesign_primer_pairs_total',
+    'Primer pairs returned by primer3.',
+))
+ASSAYS_CONSIDERED = registry.register(Counter(
+    'primerdesign_assays_considered_total',
+    'Primer pair and probe site combinations considered.',
+))
+ASSAYS_REJECTED = registry.register(Counter(
+    'primerdesign_assays_rejected_total',
+    'Primer pair and probe site combinations rejected.',
+))
+ASSAYS_REPORTED = registry.register(Counter(
+    'primerdesign_assays_reported_total',
+    'Assays reported to users.',
+))
+CACHE_HITS = registry.register(Counter(
+    'primerdesign_cache_hits_total',
+    'Query sequences served from the record cache.',
+))
+CACHE_MISSES = registry.register(Counter(
+    'primerdesign_cache_misses_total',
+    'Query sequences not found in the record cache.',
+))
+
+
+class Timings:
+    """Seconds spent in each stage of a request or design record."""
+
+    def __init__(self):
+        """Create empty timings."""
+        self.stages = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Add time spent in a stage."""
+        with self.lock:
+            self.stages[stage] += seconds
+
+    def merge(self, stages):
+        """Add the times of a {stage: seconds} dict."""
+        with self.lock:
+            for stage, seconds in stages.items():
+                self.stages[stage] += seconds
+
+    def header(self, total=None):
+        """Return the timings as a Server-Timing header value."""
+        entries = [
+            f'{stage};dur={self.stages[stage] * 1000:.1f}'
+            for stage in STAGES
+            if stage in self.stages
+        ]
+        if total is not None:
+            entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+    def observe(self):
+        """Record the stage timings in the stage histogram."""
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage)
+
+
+_current = contextvars.ContextVar('timings', default=None)
+
+
+@contextmanager
+def collect():
+    """Collect the stage timings of the enclosed code in a Timings.
+
+    Timings collected inside a nested collect() are not added to the
+    enclosing one, so that they can be merged explicitly.
+    """
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the enclosed code to a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(stage, time.perf_counter() - start)
+
+
+def merge(stages):
+    """Add {stage: seconds} timed elsewhere to the current timings."""
+    timings = _current.get()
+    if timings is not None and stages:
+        timings.merge(stages)
+
+
+def counts(iteration, cached=False):
+    """Return {counter name: amount} of a designed Iteration."""
+    return {
+        RECORDS.name: 1,
+        (CACHE_HITS if cached else CACHE_MISSES).name: 1,
+        PAIRS.name: int(iteration.primer_count['pair'] or 0),
+        ASSAYS_CONSIDERED.name: iteration.assays_considered,
+        ASSAYS_REJECTED.name: iteration.assays_rejected,
+        ASSAYS_REPORTED.name: len(iteration.assays),
+    }
+
+
+def count(iteration, cached=False):
+    """Count the records, pairs and assays of a designed Iteration."""
+    for name, amount in counts(iteration, cached).items():
+        registry.get(name).inc(amount)
+
+
+def report(data):
+    """Add the metrics of a run made in another process.
+
+    data is a dict of {stage: seconds} as 'stages' and of {counter name:
+    amount} as 'counts'.
+    """
+    for stage, seconds in data['stages'].items():
+        STAGE_SECONDS.observe(seconds, stage)
+    for name, amount in data['counts'].items():
+        registry.get(name).inc(amount)
+
+
+class TimingMiddleware:
+    """Time each request and report its stages in a Server-Timing header.
+
+    Streamed responses are produced after the view returns, so only the
+    time taken to start them is reported.
+    """
+
+    def __init__(self, get_response):
+        """Wrap the next handler in the middleware chain."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Time the request and add the Server-Timing header."""
+        start = time.perf_counter()
+        with collect() as timings:
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+        view = 'unresolved'
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            view = match.url_name or match.func.__name__
+        REQUEST_SECONDS.observe(total, view)
+        if not isinstance(response, StreamingHttpResponse):
+            timings.observe()
+            response['Server-Timing'] = timings.header(total)
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 3.1 on 2026-10-17 11:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('design', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='job',
+            name='result',
+        ),
+        migrations.CreateModel(
+            name='Result',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('name', models.TextField()),
+                ('error', models.TextField(blank=True)),
+                ('assay_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='design.job')),
+            ],
+            options={
+                'ordering': ['index'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='result',
+            constraint=models.UniqueConstraint(fields=('job', 'index'), name='unique_result_index'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-17 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('design', '0002_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='cancel_requested',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('partial', 'Partial'), ('cancelled', 'Cancelled'), ('failed', 'Failed')], default='queued', max_length=10),
+        ),
+    ]
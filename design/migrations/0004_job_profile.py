@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('design', '0003_job_cancellation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-17 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('design', '0004_job_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='worker_host',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='worker_pid',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('design', '0005_job_worker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='metrics',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='metrics_reported',
+            field=models.BooleanField(default=False),
+        ),
+    ]
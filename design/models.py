@@ -1,3 +1,392 @@
-from django.db import models
+"""Persist design runs as jobs to be drained by background workers."""
 
-# Create your models here.
+import os
+import time
+import uuid
+import pickle
+import socket
+from datetime import timedelta
+from collections import defaultdict
+from django.db import models, transaction
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics, profiling
+from .fasta import Fasta
+from .primer import PrimerDesign
+from .deadline import Deadline, DesignStopped
+
+import logging
+logger = logging.getLogger('django')
+
+# When Job.run_inline() last cleaned up jobs in this process
+_last_clean_up = None
+
+
+class Job(models.Model):
+    """A queued primer design run."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    PARTIAL = 'partial'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (PARTIAL, 'Partial'),
+        (CANCELLED, 'Cancelled'),
+        (FAILED, 'Failed'),
+    ]
+    FINISHED = (DONE, PARTIAL, CANCELLED, FAILED)
+    # Statuses under which the stored results can be shown
+    HAS_RESULTS = (DONE, PARTIAL, CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.IntegerField(default=0)
+    params = models.JSONField()
+    error = models.TextField(blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    profile = models.BooleanField(default=False)
+    # Host and process ID of the process running the job
+    worker_host = models.CharField(max_length=255, blank=True)
+    worker_pid = models.IntegerField(null=True)
+    # Stage timings and counts of the run, as given to metrics.report()
+    metrics = models.JSONField(null=True)
+    # Whether the metrics have been added to those of a server process
+    metrics_reported = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created']),
+        ]
+
+    def __str__(self):
+        """Return job ID and status."""
+        return f'{self.id} ({self.status})'
+
+    @classmethod
+    def submit(cls, params, priority=None):
+        """Queue a design run for the given form data.
+
+        The job is profiled when it runs if it is submitted from a profiled
+        request.
+        """
+        if priority is None:
+            priority = settings.JOB_DEFAULT_PRIORITY
+        return cls.objects.create(
+            params=serialize_params(params),
+            priority=priority,
+            profile=profiling.active(),
+        )
+
+    @classmethod
+    def run_inline(cls, params):
+        """Run a design in this process and return its finished job.
+
+        The job is never queued, so that workers will not claim it, but
+        its result is stored like any other for paginated display. As no
+        design worker may be running to clean up stored jobs, this is done
+        here at most every settings.JOB_CLEAN_UP_INTERVAL seconds. Its
+        metrics are counted by this process as it runs.
+        """
+        job = cls.objects.create(
+            params=serialize_params(params),
+            status=cls.RUNNING,
+            started=timezone.now(),
+            metrics_reported=True,
+            **worker_fields(),
+        )
+        job.run()
+        global _last_clean_up
+        now = time.monotonic()
+        if (_last_clean_up is None
+                or now - _last_clean_up >= settings.JOB_CLEAN_UP_INTERVAL):
+            _last_clean_up = now
+            cls.clean_up()
+        return job
+
+    @classmethod
+    def claim_next(cls):
+        """Mark the next queued job as running and return it.
+
+        Returns None if the queue is empty. The status update is
+        conditional, so that concurrent workers never claim the same job.
+        """
+        while True:
+            job = (
+                cls.objects
+                .filter(status=cls.QUEUED)
+                .order_by('-priority', 'created')
+                .only('id')
+                .first()
+            )
+            if job is None:
+                return None
+            with transaction.atomic():
+                claimed = cls.objects.filter(
+                    pk=job.pk,
+                    status=cls.QUEUED,
+                ).update(
+                    status=cls.RUNNING,
+                    started=timezone.now(),
+                    **worker_fields(),
+                )
+            if claimed:
+                return cls.objects.get(pk=job.pk)
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete finished jobs older than settings.JOB_RETENTION seconds."""
+        cutoff = timezone.now() - timedelta(seconds=settings.JOB_RETENTION)
+        deleted, _ = cls.objects.filter(
+            status__in=cls.FINISHED,
+            finished__lt=cutoff,
+        ).delete()
+        return deleted
+
+    @classmethod
+    def fail_stale(cls):
+        """Fail running jobs whose worker has gone, and return how many.
+
+        A job is stale if its worker process on this host has exited, or
+        if it started more than settings.DESIGN_DEADLINE plus
+        settings.JOB_STALE_MARGIN seconds ago, as a worker on another host
+        or one that hangs would not finish it. Stale jobs are failed
+        rather than requeued, since they may have killed their worker.
+        """
+        cutoff = timezone.now() - timedelta(
+            seconds=settings.DESIGN_DEADLINE + settings.JOB_STALE_MARGIN)
+        host = socket.gethostname()
+        stale = []
+        running = cls.objects.filter(status=cls.RUNNING).values_list(
+            'pk', 'started', 'worker_host', 'worker_pid')
+        for pk, started, worker_host, worker_pid in running:
+            if started is None or started < cutoff:
+                stale.append(pk)
+            elif worker_host == host and not pid_exists(worker_pid):
+                stale.append(pk)
+        if not stale:
+            return 0
+        return cls.objects.filter(
+            pk__in=stale,
+            status=cls.RUNNING,
+        ).update(
+            status=cls.FAILED,
+            error='The design worker stopped before the job finished',
+            finished=timezone.now(),
+        )
+
+    @classmethod
+    def report_metrics(cls):
+        """Add the metrics of jobs run by design workers to this process.
+
+        Each job is claimed by a conditional update, so that its metrics
+        are only reported by one server process.
+        """
+        finished = cls.objects.filter(
+            metrics_reported=False,
+            metrics__isnull=False,
+        ).values_list('pk', 'metrics')
+        for pk, data in finished:
+            claimed = cls.objects.filter(
+                pk=pk,
+                metrics_reported=False,
+            ).update(metrics_reported=True)
+            if claimed:
+                metrics.report(data)
+
+    @classmethod
+    def clean_up(cls):
+        """Fail stale jobs and purge expired ones."""
+        failed = cls.fail_stale()
+        if failed:
+            logger.warning(f'Failed {failed} jobs of stopped workers')
+        purged = cls.purge_expired()
+        if purged:
+            logger.info(f'Purged {purged} expired jobs')
+
+    def cancel(self):
+        """Cancel the job if it has not finished.
+
+        A queued job is cancelled at once. A running job is flagged, and
+        stops with the results completed so far when its worker next
+        checks the flag.
+        """
+        cancelled = Job.objects.filter(
+            pk=self.pk,
+            status=self.QUEUED,
+        ).update(
+            status=self.CANCELLED,
+            error='Cancelled before it started',
+            finished=timezone.now(),
+        )
+        if not cancelled:
+            Job.objects.filter(
+                pk=self.pk,
+                status=self.RUNNING,
+            ).update(cancel_requested=True)
+        self.refresh_from_db()
+
+    def is_cancel_requested(self):
+        """Return True if the job has been flagged for cancellation."""
+        return Job.objects.filter(pk=self.pk, cancel_requested=True).exists()
+
+    @property
+    def query_count(self):
+        """Return number of query sequences submitted."""
+        return len(self.params['fasta'])
+
+    @property
+    def is_finished(self):
+        """Return True if the job will not change status again."""
+        return self.status in self.FINISHED
+
+    def position(self):
+        """Return number of queued jobs that will run before this one."""
+        if self.status != self.QUEUED:
+            return 0
+        return Job.objects.filter(status=self.QUEUED).filter(
+            models.Q(priority__gt=self.priority)
+            | models.Q(priority=self.priority, created__lt=self.created)
+        ).count()
+
+    def run(self):
+        """Run the design and store the result of each query sequence.
+
+        The run is stopped after settings.DESIGN_DEADLINE seconds, or
+        when the job is cancelled, keeping the results completed so far.
+        A one-line summary of the run is logged when it ends, and its stage
+        timings and counts are stored for report_metrics().
+        """
+        start = time.monotonic()
+        deadline = Deadline(
+            settings.DESIGN_DEADLINE,
+            cancelled=self.is_cancel_requested,
+        )
+        design = None
+        sequences = assays = 0
+        counts = defaultdict(int)
+        timings = metrics.Timings()
+        try:
+            params = deserialize_params(self.params)
+            design = PrimerDesign(params, run=False, deadline=deadline)
+            with metrics.collect() as timings:
+                for i, iteration in enumerate(design.stream(params)):
+                    sequences += 1
+                    assays += len(iteration.assays)
+                    for name, amount in metrics.counts(
+                            iteration, iteration.cached).items():
+                        counts[name] += amount
+                    with metrics.timed('store'):
+                        Result.objects.create(
+                            job=self,
+                            index=i,
+                            name=iteration.name,
+                            error=iteration.error or '',
+                            assay_count=len(iteration.assays),
+                            data=pickle.dumps(iteration),
+                        )
+            self.status = self.DONE
+        except DesignStopped as exc:
+            logger.warning(f'Job {self.id} stopped: {exc}')
+            self.error = str(exc)
+            self.status = (
+                self.CANCELLED if exc.reason == 'cancelled'
+                else self.PARTIAL
+            )
+        except Exception as exc:
+            logger.exception(f'Job {self.id} failed')
+            self.error = str(exc)
+            self.status = self.FAILED
+        # Timings of the run also count towards those of an inline request
+        metrics.merge(timings.stages)
+        self.metrics = {'stages': dict(timings.stages), 'counts': counts}
+        self.finished = timezone.now()
+        self.save()
+        logger.info('Design finished', extra={'fields': {
+            'job': self.id,
+            'status': self.status,
+            'sequences': sequences,
+            'assays': assays,
+            'cache_hits': design.cache_hits if design is not None else 0,
+            'seconds': time.monotonic() - start,
+        }})
+
+    @property
+    def assay_count(self):
+        """Return number of assays across all query sequences."""
+        return self.results.aggregate(
+            total=models.Sum('assay_count'))['total'] or 0
+
+
+class Result(models.Model):
+    """The design result of one query sequence of a job.
+
+    Results are stored per sequence so that a page of a large result
+    costs no more to load than the page itself.
+    """
+
+    job = models.ForeignKey(
+        Job, on_delete=models.CASCADE, related_name='results')
+    index = models.IntegerField()
+    name = models.TextField()
+    error = models.TextField(blank=True)
+    assay_count = models.IntegerField(default=0)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['job', 'index'], name='unique_result_index'),
+        ]
+
+    def __str__(self):
+        """Return job ID and query number."""
+        return f'{self.job_id} #{self.index + 1}'
+
+    def load(self):
+        """Return the primer.Iteration of this query sequence."""
+        iteration = pickle.loads(self.data)
+        iteration.number = self.index + 1
+        return iteration
+
+
+def worker_fields():
+    """Return the Job fields identifying the current process."""
+    return {'worker_host': socket.gethostname(), 'worker_pid': os.getpid()}
+
+
+def pid_exists(pid):
+    """Return True if a process with the given ID is running."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def serialize_params(params):
+    """Return form data as JSON-serializable dict."""
+    data = dict(params)
+    data['fasta'] = list(params['fasta'].items())
+    return data
+
+
+def deserialize_params(data):
+    """Return form data from a serialized dict."""
+    params = dict(data)
+    params['fasta'] = Fasta(dict(data['fasta']))
+    return params
@@ -0,0 +1,155 @@
+"""Run per-sequence design work across a pool of worker processes."""
+
+import os
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import django
+from django.conf import settings
+
+from .deadline import DesignStopped
+
+import logging
+logger = logging.getLogger('django')
+
+# Seconds between checks of the run deadline while waiting for results
+CHECK_INTERVAL = 0.5
+
+# Items in flight per worker process. Results are held until they are
+# yielded, so this bounds the results held at once.
+ITEMS_PER_WORKER = 2
+
+# Modules imported once by the fork server rather than by every worker.
+# None of them read settings on import, as workers are given theirs.
+FORKSERVER_PRELOAD = [
+    'django.db.models',
+    'django.core.cache',
+    'django.template',
+    'numpy',
+]
+multiprocessing.get_context('forkserver').set_forkserver_preload(
+    FORKSERVER_PRELOAD)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process pool for this process.
+
+    Workers are started from a fork server rather than forked from this
+    process, whose other threads may hold locks that would never be
+    released in a forked child. They are set up with the settings of this
+    process as they are when the pool is created.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PRIMER3_PARALLELISM,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=setup_worker,
+                initargs=(current_settings(),),
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def current_settings():
+    """Return the Django settings of this process as a dict."""
+    return {
+        name: getattr(settings, name)
+        for name in dir(settings)
+        if name.isupper() and name != 'SETTINGS_MODULE'
+    }
+
+
+def setup_worker(values):
+    """Set up Django in a new worker process with the given settings."""
+    if not settings.configured:
+        settings.configure(**values)
+    django.setup()
+
+
+def reset_executor():
+    """Discard a broken process pool so that the next call starts afresh."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def imap(func, items, on_error, deadline=None):
+    """Yield func(item) for each item in input order.
+
+    Items are processed concurrently in worker processes, with at most
+    ITEMS_PER_WORKER items per worker submitted ahead of the one being
+    yielded. If func raises for an item, on_error(item, exc) is yielded in
+    its place so that one bad item does not fail the others. If the
+    deadline passes, or func raises DesignStopped, items not yet started
+    are cancelled and DesignStopped is raised. Items in progress stop at
+    their next check of the deadline, which is shared with the worker
+    processes so that they also see the run being cancelled.
+    """
+    if deadline is not None:
+        deadline.share()
+    items = iter(items)
+    window = settings.PRIMER3_PARALLELISM * ITEMS_PER_WORKER
+    pending = deque()
+
+    def submit():
+        """Submit items until the window is full."""
+        for item in itertools.islice(items, window - len(pending)):
+            pending.append((item, get_executor().submit(func, item)))
+
+    try:
+        submit()
+        while pending:
+            item, future = pending.popleft()
+            try:
+                value = result(future, deadline)
+            except DesignStopped:
+                raise
+            except BrokenProcessPool as exc:
+                logger.warning(f'Design worker process died: {exc}')
+                reset_executor()
+                value = on_error(item, exc)
+            except Exception as exc:
+                logger.warning(f'Design worker raised: {exc!r}')
+                value = on_error(item, exc)
+            del future
+            submit()
+            yield value
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def call(func, item, on_error):
+    """Return func(item) in this process, or on_error(item, exc).
+
+    Handles errors as imap() does, for items designed serially.
+    """
+    try:
+        return func(item)
+    except DesignStopped:
+        raise
+    except Exception as exc:
+        logger.warning(f'Design raised: {exc!r}')
+        return on_error(item, exc)
+
+
+def result(future, deadline=None):
+    """Return the result of a future, checking the deadline while waiting."""
+    if deadline is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=CHECK_INTERVAL)
+        except TimeoutError:
+            deadline.check()
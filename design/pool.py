@@ -0,0 +1,344 @@
+"""A pool of long-lived primer3 processes fed over stdin.
+
+Each worker keeps a ``primer3_core`` process running between requests, so
+that the thermodynamic parameters are loaded once per worker rather than
+once per request. Boulder-IO records are written to the process's stdin
+and results are read back from its stdout one record at a time.
+"""
+
+import os
+import time
+import queue
+import codecs
+import select
+import shutil
+import atexit
+import threading
+import subprocess
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+
+from . import boulder, metrics
+from .deadline import DesignStopped
+
+import logging
+logger = logging.getLogger('django')
+
+THERMODYNAMIC_PATH_TAG = 'PRIMER_THERMODYNAMIC_PARAMETERS_PATH'
+PING_RECORD = {
+    'SEQUENCE_ID': 'ping',
+    'SEQUENCE_TEMPLATE': 'ACGTACGTACGTACGTACGT',
+}
+
+
+# Seconds between checks of the run deadline while waiting for primer3 or
+# for a worker to become free
+READ_POLL_INTERVAL = 0.5
+
+
+class Primer3Error(RuntimeError):
+    """Raised when a primer3 worker process fails."""
+
+
+class Primer3Timeout(Primer3Error):
+    """Raised when primer3 takes too long over a record."""
+
+
+class Primer3Worker:
+    """A single primer3_core process reading records from stdin."""
+
+    def __init__(self):
+        """Start the primer3 process."""
+        self.proc = None
+        self.start()
+
+    def command(self):
+        """Return the command line used to start primer3."""
+        args = [settings.PRIMER3_PATH]
+        # primer3 writes to a block-buffered stdout when it is a pipe, which
+        # would hold back each record's output until the buffer fills.
+        stdbuf = shutil.which('stdbuf')
+        if stdbuf:
+            args = [stdbuf, '-oL'] + args
+        return args
+
+    def start(self):
+        """Start (or restart) the primer3 process.
+
+        Raises Primer3Error if the process can not be started.
+        """
+        self.stop()
+        try:
+            self.proc = subprocess.Popen(
+                self.command(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding='utf-8',
+                bufsize=1,
+            )
+        except OSError as exc:
+            raise Primer3Error(f'primer3 process could not start: {exc}')
+        self.configured = False
+        self.records_served = 0
+        self.last_used = time.time()
+
+    def stop(self):
+        """Terminate the primer3 process."""
+        if self.proc is None:
+            return
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc = None
+
+    def alive(self):
+        """Return True if the primer3 process is running."""
+        return self.proc is not None and self.proc.poll() is None
+
+    def ping(self):
+        """Return True if the process answers a trivial record."""
+        try:
+            self.send(PING_RECORD)
+            return True
+        except Primer3Error:
+            return False
+
+    def lines(self, timeout=None, deadline=None):
+        """Yield lines of primer3 output as they become available.
+
+        Raises Primer3Timeout if no complete record arrives within timeout
+        seconds, and DesignStopped if the run deadline passes while
+        waiting. The process is left mid-record in either case and must be
+        restarted.
+        """
+        fd = self.proc.stdout.fileno()
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        expires = time.time() + timeout if timeout is not None else None
+        pending = ''
+        while True:
+            while '\n' in pending:
+                line, pending = pending.split('\n', 1)
+                yield line + '\n'
+            if deadline is not None:
+                deadline.check()
+            wait = READ_POLL_INTERVAL
+            if expires is not None:
+                left = expires - time.time()
+                if left <= 0:
+                    raise Primer3Timeout(
+                        f'primer3 took longer than {timeout:.1f}s')
+                wait = min(wait, left)
+            ready, _, _ = select.select([fd], [], [], wait)
+            if not ready:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                if pending:
+                    yield pending
+                return
+            pending += decoder.decode(data)
+
+    def send(self, tags, debug_file=None, deadline=None):
+        """Write a record to primer3 and return the parsed output record.
+
+        Raw output is copied to debug_file if given. A record may take up
+        to settings.PRIMER3_RECORD_TIMEOUT seconds, and no longer than the
+        run deadline allows.
+        """
+        if not self.alive():
+            raise Primer3Error('primer3 process is not running')
+        if self.configured:
+            # Thermodynamic parameters persist between records. Sending the
+            # path again may cause primer3 to reload them.
+            tags = {
+                k: v for k, v in tags.items()
+                if k != THERMODYNAMIC_PATH_TAG
+            }
+        elif THERMODYNAMIC_PATH_TAG in tags:
+            self.configured = True
+        try:
+            with metrics.timed('primer3'):
+                self.proc.stdin.write(boulder.format_record(tags))
+                self.proc.stdin.flush()
+                timeout = settings.PRIMER3_RECORD_TIMEOUT
+                if deadline is not None:
+                    timeout = deadline.timeout(timeout)
+                output = []
+                lines = self.lines(timeout, deadline)
+                for line in boulder.tee(lines, debug_file):
+                    output.append(line)
+                    if line.rstrip('\r\n') == boulder.RECORD_END:
+                        break
+            with metrics.timed('parse'):
+                record = next(boulder.parse(output), None)
+        except (OSError, ValueError) as exc:
+            raise Primer3Error(f'primer3 process failed: {exc}')
+        if record is None:
+            raise Primer3Error(
+                'primer3 process exited with code'
+                + f' {self.proc.poll()}'
+            )
+        self.records_served += 1
+        self.last_used = time.time()
+        return record
+
+
+class Primer3Pool:
+    """A fixed-size pool of primer3 workers."""
+
+    def __init__(self, size):
+        """Create the pool. Workers are started on first use."""
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.started = 0
+
+    @contextmanager
+    def acquire(self, deadline=None):
+        """Check out a healthy worker for the duration of the context.
+
+        The worker is returned to the pool however the context ends. One
+        that failed, or could not be restarted, is returned stopped, to be
+        restarted when next checked out.
+        """
+        worker = self._get(deadline)
+        try:
+            if not self.healthy(worker):
+                logger.warning('Restarting unhealthy primer3 worker')
+                worker.start()
+            yield worker
+        except (Primer3Error, DesignStopped):
+            # The worker may be part way through a record
+            worker.stop()
+            raise
+        finally:
+            self.idle.put(worker)
+
+    def _get(self, deadline=None):
+        """Return an idle worker, starting one if the pool is not full.
+
+        Raises DesignStopped if the deadline passes while every worker is
+        busy, and Primer3Error if a new worker can not be started.
+        """
+        while True:
+            with self.lock:
+                if self.idle.empty() and self.started < self.size:
+                    worker = Primer3Worker()
+                    self.started += 1
+                    return worker
+            try:
+                return self.idle.get(timeout=READ_POLL_INTERVAL)
+            except queue.Empty:
+                if deadline is not None:
+                    deadline.check()
+
+    def healthy(self, worker):
+        """Return True if the worker can accept records."""
+        if not worker.alive():
+            return False
+        idle_time = time.time() - worker.last_used
+        if idle_time > settings.PRIMER3_POOL_HEALTH_INTERVAL:
+            return worker.ping()
+        return True
+
+    def run(self, records, debug_file=None, deadline=None):
+        """Yield an output record for each input record.
+
+        A record that crashes its worker or times out is returned with
+        PRIMER_ERROR set and the worker is restarted for the remaining
+        records. DesignStopped is raised if the run deadline passes.
+        """
+        with self.acquire(deadline) as worker:
+            for tags in records:
+                try:
+                    output = worker.send(tags, debug_file, deadline)
+                except Primer3Error as exc:
+                    logger.warning(f'Restarting crashed primer3 worker: {exc}')
+                    worker.start()
+                    output = error_record(tags, str(exc))
+                yield output
+
+    def map(self, records, deadline=None):
+        """Return output records for input records run concurrently.
+
+        Records are spread over up to ``size`` workers, each fed from its
+        own thread since the work happens in the primer3 processes.
+        Results are returned in input order.
+        """
+        records = list(records)
+        if len(records) < 2 or self.size < 2:
+            return list(self.run(records, deadline=deadline))
+        outputs = [None] * len(records)
+        todo = queue.Queue()
+        for item in enumerate(records):
+            todo.put(item)
+        stopped = []
+
+        def drain():
+            while not stopped:
+                try:
+                    i, tags = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    outputs[i] = list(self.run([tags], deadline=deadline))[0]
+                except DesignStopped as exc:
+                    stopped.append(exc)
+
+        # Threads report stage timings to the caller's metrics collector
+        threads = [
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(drain,))
+            for _ in range(min(self.size, len(records)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if stopped:
+            raise stopped[0]
+        return outputs
+
+    def close(self):
+        """Stop all idle workers."""
+        while not self.idle.empty():
+            self.idle.get().stop()
+        self.started = 0
+
+
+def error_record(tags, message):
+    """Return an output record reporting an error for the input record."""
+    return boulder.Record({
+        'SEQUENCE_ID': tags.get('SEQUENCE_ID'),
+        'SEQUENCE_TEMPLATE': tags.get('SEQUENCE_TEMPLATE'),
+        'PRIMER_ERROR': message,
+    })
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the primer3 pool for this process."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Never share pipes with a forked parent's workers
+            _pool = Primer3Pool(settings.PRIMER3_POOL_SIZE)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
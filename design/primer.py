@@ -4,37 +4,21 @@ import os
 import time
 import string
 import random
-import subprocess
+import functools
 from django.conf import settings
-from django.template.loader import render_to_string
+
+from . import (
+    boulder, cache, metrics, parallel, profiling, ranking, regions,
+    specificity, tiling, vectorized,
+)
+from .cache import cache_key
+from .deadline import DesignStopped
+from .pool import get_pool, error_record
+from .matcher import get_library, get_matcher, ProbeSiteIndex
 
 import logging
 logger = logging.getLogger('django')
 
-COMPLEMENT = {
-    'A': 'T',
-    'T': 'A',
-    'G': 'C',
-    'C': 'G',
-}
-
-PRODUCT_SIZE_RANGES = [
-    (101, 200),
-    (201, 300),
-    (301, 400),
-    (401, 500),
-    (501, 600),
-    (601, 700),
-    (701, 850),
-    (851, 1000),
-    (1001, 1500),
-    (1501, 3000),
-    (3001, 5000),
-    (5001, 7000),
-    (7001, 10000),
-    (10001, 20000),
-]
-
 
 class PrimerDesign:
     """Analyse a target DNA sequence with primer3 for potential primers.
@@ -44,11 +28,25 @@ class PrimerDesign:
     hybridization sites.
     """
 
-    def __init__(self, params):
-        """Run primer3 with the given target sequences and render output."""
+    def __init__(self, params, run=True, deadline=None):
+        """Run primer3 with the given target sequences and render output.
+
+        With run=False nothing is run until stream() is called. If the
+        run is stopped by its deadline.Deadline, the iterations completed
+        so far are kept and the DesignStopped exception is set as stopped.
+        """
         self.params = params
-        self.iterations = self.run(params)
-        self.total_assay_count = sum([
+        self.deadline = deadline
+        self.iterations = []
+        self.cache_hits = 0
+        self.stopped = None
+        if run:
+            self.iterations = self.run(params)
+
+    @property
+    def total_assay_count(self):
+        """Return number of assays across all iterations."""
+        return sum([
             len(iteration.assays)
             for iteration in self.iterations
         ])
@@ -88,151 +86,425 @@ class PrimerDesign:
         raise StopIteration
 
     def create_input(self, params):
-        """Parse the target parameters to a primer3 input file."""
-        def get_size_range(params):
-            """Calculate valid Primer3 size range from amplicon min/max."""
-            if not params['amplicon_min']:
-                return
-
-            selected = []
-            for size in PRODUCT_SIZE_RANGES:
-                if params['amplicon_min'] > size[1]:
-                    continue
-                if params['amplicon_max'] < size[0]:
-                    break
-                selected.append('-'.join([str(x) for x in size]))
-            return ' '.join(selected)
-
-        alphanumeric = string.ascii_letters + string.digits
-        input_path = os.path.join(
-            settings.PRIMER3_INPUT_DIR,
-            '%s.conf' % ''.join([
-                random.choice(alphanumeric)
-                for i in range(12)
-            ])
-        )
-        if settings.PRIMER3_DEBUG:
-            logger.info(
-                'Running primer3 input: '
-                + os.path.basename(input_path)
-            )
-        params['product_size_range'] = get_size_range(params)
-        params['conf_path'] = settings.PRIMER3_CONFIG_PATH
-        with open(input_path, 'w') as f:
-            f.write(render_to_string('design/input.template', params))
-        return input_path
+        """Return primer3 input records for the target sequences."""
+        global_tags = primer3_tags(params)
+        return [
+            dict(global_tags, SEQUENCE_ID=name, SEQUENCE_TEMPLATE=template)
+            for name, template in params['fasta'].items()
+        ]
 
     def run(self, params):
         """Analyse the target sequence with primer3."""
-        input_path = self.create_input(params)
-        args = [
-            settings.PRIMER3_PATH,
-            input_path,
-        ]
+        iterations = []
         try:
-            result = subprocess.run(args, check=True, capture_output=True)
-        except Exception as exc:
-            raise RuntimeError(
-                f"Primer3 returned error code {exc.returncode}. Output:"
-                + '\n' + exc.stdout.decode('utf-8')
-                + '\n' + exc.stderr.decode('utf-8')
-            )
-        clean_input_files(input_path)
-
+            for iteration in self.stream(params):
+                iterations.append(iteration)
+        except DesignStopped as exc:
+            logger.warning(f'{exc} after {len(iterations)} sequences')
+            self.stopped = exc
+        return iterations
+
+    def stream(self, params):
+        """Yield an Iteration for each record as primer3 outputs it.
+
+        Raises DesignStopped if the deadline passes or the run is
+        cancelled. Closing the generator stops any further design work.
+        """
+        with metrics.timed('input'):
+            records = self.create_input(params)
+        debug_file = None
         if settings.PRIMER3_DEBUG:
+            alphanumeric = string.ascii_letters + string.digits
             out = os.path.join(
                 settings.PRIMER3_OUTPUT_DIR,
-                os.path.basename(input_path).replace('.conf', '.out')
+                '%s.out' % ''.join([
+                    random.choice(alphanumeric)
+                    for i in range(12)
+                ])
             )
-            with open(out, 'w') as f:
-                f.write(result.stdout.decode('utf-8') + '\n')
+            logger.info('Running primer3 output: ' + os.path.basename(out))
+            debug_file = open(out, 'w')
+            for tags in records:
+                debug_file.write(boulder.format_record(tags))
+
+        filters = probe_filters(params)
+        steps = self.num_return_steps(params)
+        with metrics.timed('input'):
+            units = [
+                (tags, self.plan(tags, params, filters), steps)
+                for tags in records
+            ]
 
-        return [
-            Iteration('SEQUENCE_ID=' + x)
-            for x in result.stdout.decode('utf-8').split('SEQUENCE_ID=')[1:]
-        ]
+        designed = self.design(units, filters, debug_file)
+        try:
+            for _ in units:
+                if self.deadline is not None:
+                    self.deadline.check()
+                _, iteration = next(designed)
+                self.cache_hits += iteration.cached
+                metrics.merge(iteration.timings)
+                metrics.count(iteration, cached=iteration.cached)
+                yield iteration
+        finally:
+            designed.close()
+            if debug_file:
+                debug_file.close()
+                clean_output_files()
+
+    def plan(self, tags, params, filters):
+        """Return the (offset, tags) primer3 records to run for a record.
+
+        Long templates are split into overlapping windows when tiling is
+        requested. With settings.PROBE_REGION_RESTRICTION, each record is
+        restricted to the regions that can flank a probe site, and records
+        without any such region are dropped. In probe-targeted mode a
+        record targeting each cluster of probe sites is run instead.
+        """
+        matcher = get_matcher(get_library(filters['probe_library']))
+        if params.get('mode') == 'probe':
+            return regions.target(
+                tags,
+                ProbeSiteIndex(matcher, tags['SEQUENCE_TEMPLATE']),
+                params,
+                filters['probe_distance'],
+                settings.PROBE_TARGET_NUM_RETURN,
+            )
+
+        plan = [(0, tags)]
+        if params.get('tiling'):
+            size = tiling.window_size(params, settings.TILING_WINDOW)
+            if len(tags['SEQUENCE_TEMPLATE']) > size:
+                plan = tiling.tile(tags, size, params['amplicon_max'])
+        if not settings.PROBE_REGION_RESTRICTION:
+            return plan
+
+        restricted = []
+        for offset, window in plan:
+            # Regions allowing any probe distance hold those of every
+            # distance, so that the distance stays out of the cache key
+            window = regions.restrict(
+                window,
+                ProbeSiteIndex(matcher, window['SEQUENCE_TEMPLATE']),
+                params,
+                0,
+            )
+            if window is not None:
+                restricted.append((offset, window))
+        return restricted
+
+    def num_return_steps(self, params):
+        """Return the increasing PRIMER_NUM_RETURN values to try per record.
+
+        Records in probe-targeted mode already ask for a few pairs per
+        probe site, so they are run once as planned.
+        """
+        if params.get('mode') == 'probe':
+            return [None]
+        return list(settings.PRIMER3_NUM_RETURN_STEPS)
+
+    def design(self, units, filters, debug_file=None):
+        """Yield (record, Iteration) for each planned unit, in input order.
+
+        Units are designed in this process when it is being profiled, or
+        when primer3 input and output are written to debug_file, which
+        worker processes can not share. A unit that fails is yielded as an
+        error record either way.
+        """
+        if not units:
+            return
+        on_error = functools.partial(failed_record, filters=filters)
+        if (
+            settings.PRIMER3_PARALLELISM > 1
+            and len(units) > 1
+            and not profiling.active()
+            and debug_file is None
+        ):
+            yield from parallel.imap(
+                functools.partial(
+                    design_record, filters=filters, deadline=self.deadline),
+                units,
+                on_error,
+                self.deadline,
+            )
+        else:
+            func = functools.partial(
+                design_record,
+                filters=filters,
+                debug_file=debug_file,
+                deadline=self.deadline,
+            )
+            for unit in units:
+                yield parallel.call(func, unit, on_error)
+
+
+def run_plan(tags, plan, debug_file=None, deadline=None):
+    """Run the planned primer3 records and return one output record."""
+    if not plan:
+        record = tiling.merge(tags, [])
+        record.tags['PRIMER_WARNING'] = 'No probe sites on template'
+        return record
+    if len(plan) == 1 and plan[0][1]['SEQUENCE_ID'] == tags['SEQUENCE_ID']:
+        return list(get_pool().run([plan[0][1]], debug_file, deadline))[0]
+    outputs = get_pool().map([window for _, window in plan], deadline)
+    return tiling.merge(
+        tags,
+        [(offset, output) for (offset, _), output in zip(plan, outputs)],
+    )
+
+
+def saturated(record, num_return):
+    """Return True if any primer3 record returned num_return pairs.
+
+    Pairs found in the overlap of tiled windows are merged, so the counts
+    each window returned are compared rather than the merged count.
+    """
+    counts = record.get(tiling.WINDOW_COUNTS_TAG)
+    if counts is None:
+        counts = record.get('PRIMER_PAIR_NUM_RETURNED', '0')
+    return any(
+        int(count) >= num_return for count in counts.split(',') if count
+    )
+
+
+def design_record(unit, filters, debug_file=None, deadline=None):
+    """Run a single input record through primer3 and probe matching.
+
+    primer3 is first asked for a few pairs, and asked again for more only
+    while probe matching yields fewer than settings.PRIMER3_ASSAY_QUOTA
+    assays and some primer3 record, such as one window of a tiled record,
+    returned as many pairs as were asked for. If the deadline passes while
+    asking for more, the last result is kept.
+
+    The output of each step is cached by its primer3 records, so that a
+    record goes exactly as deep for the same filters whatever is cached,
+    and only the steps not cached before are run. The Iteration is marked
+    cached if primer3 was not run at all.
+
+    The time spent in each stage is returned as iteration.timings, since
+    this may run in another process.
+    """
+    tags, plan, steps = unit
+    iteration = None
+    cached = True
+    with metrics.collect() as timings:
+        # Without steps, the planned records are run once as they are
+        for num_return in steps or [None]:
+            if num_return is not None:
+                plan = [
+                    (offset, dict(window, PRIMER_NUM_RETURN=num_return))
+                    for offset, window in plan
+                ]
+            # Without a plan nothing is run, and every such key is the same
+            key = cache_key(plan) if plan else None
+            record = None
+            if key:
+                with metrics.timed('cache'):
+                    record = cache.records.get(key)
+            if record is not None:
+                record = record.renamed(tags['SEQUENCE_ID'])
+            else:
+                try:
+                    record = run_plan(tags, plan, debug_file, deadline)
+                except DesignStopped:
+                    if iteration is None:
+                        raise
+                    break
+                cached = False
+                if key and not record.get('PRIMER_ERROR'):
+                    with metrics.timed('cache'):
+                        cache.records.set(key, record)
+            iteration = Iteration(record, filters)
+            if iteration.error:
+                break
+            if len(iteration.assays) >= settings.PRIMER3_ASSAY_QUOTA:
+                break
+            if num_return is None or not plan:
+                break
+            if not saturated(record, num_return):
+                break
+    iteration.timings = dict(timings.stages)
+    iteration.cached = cached
+    return record, iteration
+
+
+def failed_record(unit, exc, filters):
+    """Return an error record and Iteration for the input record."""
+    record = error_record(unit[0], f'Design failed: {exc}')
+    return record, Iteration(record, filters)
+
+
+def probe_filters(params):
+    """Return the probe matching settings for the target parameters.
+
+    Except for the probe library, which decides the regions primer3 is
+    restricted to, these only affect post-processing of primer3 output,
+    so changing them does not require primer3 to be run again. The probe
+    distance also shapes the records of probe-targeted mode.
+    """
+    filters = {
+        'probe_distance': params.get('probe_distance'),
+        'assays_per_probe': params.get('assays_per_probe'),
+        'probe_library': params.get('probe_library'),
+    }
+    if filters['probe_distance'] is None:
+        filters['probe_distance'] = settings.MIN_PROBE_DISTANCE
+    if not filters['assays_per_probe']:
+        filters['assays_per_probe'] = settings.ASSAYS_PER_PROBE
+    if not filters['probe_library']:
+        filters['probe_library'] = settings.DEFAULT_PROBE_LIBRARY
+    return filters
+
+
+def primer3_tags(params):
+    """Return the global primer3 input tags for the target parameters.
+
+    For details on input tags see:
+    https://primer3.org/manual.html#globalTags
+    """
+    return {
+        'PRIMER_TASK': 'pick_detection_primers',
+        'PRIMER_PICK_LEFT_PRIMER': 1,
+        'PRIMER_PICK_INTERNAL_OLIGO': 0,
+        'PRIMER_PICK_RIGHT_PRIMER': 1,
+        'PRIMER_OPT_SIZE': params['primer_optimum'],
+        'PRIMER_MIN_SIZE': params['primer_min'],
+        'PRIMER_MAX_SIZE': params['primer_max'],
+        'PRIMER_MAX_SELF_ANY': params['self_dimer_any'],
+        'PRIMER_MAX_SELF_END': params['self_dimer_end'],
+        'PRIMER_OPT_TM': params['tm_optimum'],
+        'PRIMER_MIN_TM': params['tm_min'],
+        'PRIMER_MAX_TM': params['tm_max'],
+        'PRIMER_GC_CLAMP': params['gc_clamp'],
+        'PRIMER_MIN_GC': params['gc_min'],
+        'PRIMER_MAX_NS_ACCEPTED': 1,
+        'PRIMER_NUM_RETURN': 100,
+        'PRIMER_PRODUCT_SIZE_RANGE':
+            f"{params['amplicon_min']}-{params['amplicon_max']}",
+        'PRIMER_PRODUCT_MAX': params['amplicon_max'],
+        'P3_FILE_FLAG': 0,
+        'PRIMER_EXPLAIN_FLAG': 1,
+        'PRIMER_THERMODYNAMIC_PARAMETERS_PATH': settings.PRIMER3_CONFIG_PATH,
+    }
 
 
 class Iteration:
     """Holds primer predictions for a single query sequence."""
 
-    def __init__(self, output):
-        """Parse iteration data from output string."""
-        data = {
-            line.split('=')[0]: line.split('=')[1]
-            for line in output.split('\n')
-            if '=' in line
-        }
+    def __init__(self, record, filters=None):
+        """Parse iteration data from a primer3 output record."""
+        self.filters = filters or probe_filters({})
+        # Seconds spent per design stage, when designed by design_record
+        self.timings = {}
+        # Whether design_record found every primer3 record in the cache
+        self.cached = False
         self.assays_rejected = 0
         self.assays_considered = 0
-        self.name = data['SEQUENCE_ID']
-        self.sequence = data['SEQUENCE_TEMPLATE']
+        self.name = record['SEQUENCE_ID']
+        self.sequence = record['SEQUENCE_TEMPLATE']
+        self.error = record.get('PRIMER_ERROR')
         self.explanation = {
-            'pair': data['PRIMER_PAIR_EXPLAIN'],
-            'left': data['PRIMER_LEFT_EXPLAIN'],
-            'right': data['PRIMER_RIGHT_EXPLAIN'],
+            'pair': record.get('PRIMER_PAIR_EXPLAIN'),
+            'left': record.get('PRIMER_LEFT_EXPLAIN'),
+            'right': record.get('PRIMER_RIGHT_EXPLAIN'),
         }
         self.primer_count = {
-            'pair': data['PRIMER_PAIR_NUM_RETURNED'],
-            'left': data['PRIMER_LEFT_NUM_RETURNED'],
-            'right': data['PRIMER_RIGHT_NUM_RETURNED'],
-            'internal': data['PRIMER_INTERNAL_NUM_RETURNED'],
+            'pair': record.get('PRIMER_PAIR_NUM_RETURNED', '0'),
+            'left': record.get('PRIMER_LEFT_NUM_RETURNED', '0'),
+            'right': record.get('PRIMER_RIGHT_NUM_RETURNED', '0'),
+            'internal': record.get('PRIMER_INTERNAL_NUM_RETURNED', '0'),
         }
-        self.assays = self.parse_assays(data, self.sequence)
-
-    def parse_assays(self, data, sequence_template):
-        """Parse primer pairs from output dict."""
-        def key_matches_index(i, key):
-            """Parse int index from key string."""
-            try:
-                return key.split('_')[2] == str(i)
-            except IndexError:
-                return False
-
-        def reduced(assays):
-            """Return only 5 assays per probe."""
-            reduced = []
-            probe_count = {}
-            for assay in assays:
-                if not assay.probe:
-                    continue
-                probe_id = assay.probe['id']
-                if probe_id not in probe_count:
-                    probe_count[probe_id] = 1
-                    reduced.append(assay)
-                    continue
-                if probe_count[probe_id] < 5:
-                    probe_count[probe_id] += 1
-                    reduced.append(assay)
-            return reduced
-
-        i = 0
-        assays = []
-        while data.get(f'PRIMER_LEFT_{ i }_SEQUENCE'):
-            assay_data = {
-                k: v for k, v in data.items()
-                if key_matches_index(i, k)
-            }
-            builder = AssayBuilder(self, i, assay_data, sequence_template)
-            assays += builder.build()
-            i += 1
-
-        return reduced(assays)
+        if self.error:
+            logger.info(
+                'Primer3 error for "%s": %s', self.name, self.error,
+                extra={'sample': 'primer3-error'})
+        with metrics.timed('match'):
+            library = get_library(self.filters['probe_library'])
+            self.probe_sites = ProbeSiteIndex(
+                get_matcher(library), self.sequence)
+            self.assays = self.parse_assays(record, self.sequence)
+
+    def __getstate__(self):
+        """Drop the probe site index when pickling parsed results."""
+        state = self.__dict__.copy()
+        state.pop('probe_sites', None)
+        return state
+
+    def parse_assays(self, record, sequence_template):
+        """Parse primer pairs from output record and rank the assays."""
+        ranker = ranking.Ranker(
+            self.filters['assays_per_probe'],
+            settings.ASSAYS_PER_SEQUENCE,
+        )
+        pairs = []
+        for pair in record.pairs:
+            if not pair.get('LEFT_SEQUENCE'):
+                break
+            pairs.append(pair)
+
+        if vectorized.enabled():
+            # Only pairs with acceptable probe sites need to be built
+            matched = vectorized.match_probes(
+                self, pairs, self.filters['assays_per_probe']).items()
+        else:
+            matched = ((i, None) for i in range(len(pairs)))
+        screen = specificity.enabled()
+        for i, probes in matched:
+            builder = AssayBuilder(
+                self, i, pairs[i], sequence_template, probes=probes)
+            if screen and builder.probes:
+                builder.off_targets = specificity.off_targets(
+                    builder.left.sequence,
+                    builder.right.sequence,
+                    builder.amplicon_bp,
+                )
+            for probe in builder.probes:
+                ranker.offer(builder, probe)
 
-    def get_probe_ids(self):
-        """Return unique list of probe IDs sorted numerically."""
         return [
-            str(x)
-            for x in sorted(
-                list(
-                    {
-                        int(assay.probe['id'])
-                        for assay in self.assays
-                    }
-                )
-            )
+            Assay(builder, probe, score)
+            for score, builder, probe in ranker.ranked()
         ]
 
+    def as_dict(self):
+        """Return iteration as a JSON-serializable dict."""
+        return {
+            'name': self.name,
+            'error': self.error,
+            'assays_considered': self.assays_considered,
+            'assays_rejected': self.assays_rejected,
+            'assays': [assay.as_dict() for assay in self.assays],
+        }
+
+    def as_compact_dict(self):
+        """Return the data needed to draw assay alignments in the browser.
+
+        The template sequence is included once, and each assay is reduced
+        to the coordinates and sequences of its primers and probe.
+        """
+        return {
+            'name': self.name,
+            'error': self.error,
+            'sequence': self.sequence,
+            'assays': [assay.as_compact_list() for assay in self.assays],
+        }
+
+    def get_probe_ids(self):
+        """Return unique list of probe IDs sorted numerically.
+
+        IDs are kept as strings, since those of other probe libraries may
+        not be numbers. Such IDs are sorted after numeric ones.
+        """
+        def numeric_first(probe_id):
+            """Return sort key of a probe ID."""
+            if probe_id.isdigit():
+                return 0, int(probe_id), ''
+            return 1, 0, probe_id
+
+        return sorted(
+            {str(assay.probe['id']) for assay in self.assays},
+            key=numeric_first,
+        )
+
     def get_probes_string(self):
         """Return string list of probe IDs."""
         probe_ids = self.get_probe_ids()
@@ -242,127 +514,207 @@ class Iteration:
             return 'probes #' + ', #'.join(probe_ids)
 
 
+class Primer:
+    """A single primer of a primer pair."""
+
+    __slots__ = (
+        'penalty',
+        'sequence',
+        'start',
+        'end',
+        'length',
+        'tm',
+        'gc',
+        'self_dimer_any_th',
+        'self_dimer_end_th',
+        'hairpin_th',
+        'end_stability',
+    )
+
+    def __init__(self, data, side, start, end, length):
+        """Parse primer details for side LEFT or RIGHT of a pair."""
+        self.penalty = float(data[f'{side}_PENALTY'])
+        self.sequence = data[f'{side}_SEQUENCE']
+        self.start = start
+        self.end = end
+        self.length = length
+        self.tm = float(data[f'{side}_TM'])
+        self.gc = float(data[f'{side}_GC_PERCENT'])
+        self.self_dimer_any_th = float(data[f'{side}_SELF_ANY_TH'])
+        self.self_dimer_end_th = float(data[f'{side}_SELF_END_TH'])
+        self.hairpin_th = float(data[f'{side}_HAIRPIN_TH'])
+        self.end_stability = float(data[f'{side}_END_STABILITY'])
+
+    def __getitem__(self, key):
+        """Return attribute by key, as for the former dict of details."""
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def as_dict(self):
+        """Return primer as a JSON-serializable dict."""
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
 class AssayBuilder:
-    """A PCR assay with potentially multiple probe sites."""
+    """A PCR assay with potentially multiple probe sites.
+
+    Amplicon sequences are sliced from the query template on access, so
+    that builders of discarded assays hold no copies of the sequence.
+    """
 
-    def __init__(self, parent, ix, data, sequence_template):
-        """Parse details from output string."""
+    __slots__ = (
+        'query',
+        'index',
+        'penalty',
+        'left',
+        'right',
+        'complement_any_th',
+        'complement_end_th',
+        'amplicon_bp',
+        'probes',
+        'off_targets',
+    )
+
+    def __init__(self, parent, ix, data, sequence_template=None, probes=None):
+        """Parse details from a primer pair of the output record.
+
+        Probes already matched to the pair may be given as probes.
+        off_targets is set when the pair is screened for specificity.
+        """
         self.query = parent
         self.index = ix + 1
-        self.left = {
-            'penalty': float(data[f'PRIMER_LEFT_{ ix }_PENALTY']),
-            'sequence': data[f'PRIMER_LEFT_{ ix }_SEQUENCE'],
-            'start': int(data[f'PRIMER_LEFT_{ ix }'].split(',')[0]),
-            'end': (int(data[f'PRIMER_LEFT_{ ix }'].split(',')[0])
-                    + int(data[f'PRIMER_LEFT_{ ix }'].split(',')[1])),
-            'length': int(data[f'PRIMER_LEFT_{ ix }'].split(',')[1]),
-            'tm': float(data[f'PRIMER_LEFT_{ ix }_TM']),
-            'gc': float(data[f'PRIMER_LEFT_{ ix }_GC_PERCENT']),
-            'self_dimer_any_th':
-                float(data[f'PRIMER_LEFT_{ ix }_SELF_ANY_TH']),
-            'self_dimer_end_th':
-                float(data[f'PRIMER_LEFT_{ ix }_SELF_END_TH']),
-            'hairpin_th': float(data[f'PRIMER_LEFT_{ ix }_HAIRPIN_TH']),
-            'end_stability': float(data[f'PRIMER_LEFT_{ ix }_END_STABILITY']),
-        }
-        self.right = {
-            'penalty': float(data[f'PRIMER_RIGHT_{ ix }_PENALTY']),
-            'sequence': data[f'PRIMER_RIGHT_{ ix }_SEQUENCE'],
-            'start': (int(data[f'PRIMER_RIGHT_{ ix }'].split(',')[0])
-                      + 2 - int(data[f'PRIMER_RIGHT_{ ix }'].split(',')[1])),
-            'end': int(data[f'PRIMER_RIGHT_{ ix }'].split(',')[0]) + 1,
-            'length': int(data[f'PRIMER_RIGHT_{ ix }'].split(',')[1]),
-            'tm': float(data[f'PRIMER_RIGHT_{ ix }_TM']),
-            'gc': float(data[f'PRIMER_RIGHT_{ ix }_GC_PERCENT']),
-            'self_dimer_any_th':
-                float(data[f'PRIMER_RIGHT_{ ix }_SELF_ANY_TH']),
-            'self_dimer_end_th':
-                float(data[f'PRIMER_RIGHT_{ ix }_SELF_END_TH']),
-            'hairpin_th': float(data[f'PRIMER_RIGHT_{ ix }_HAIRPIN_TH']),
-            'end_stability': float(data[f'PRIMER_RIGHT_{ ix }_END_STABILITY']),
-        }
-        self.complement_any_th = data[f'PRIMER_PAIR_{ ix }_COMPL_ANY_TH']
-        self.complement_end_th = data[f'PRIMER_PAIR_{ ix }_COMPL_END_TH']
-        self.amplicon_bp = data[f'PRIMER_PAIR_{ ix }_PRODUCT_SIZE']
-        self.amplicon = sequence_template[
-            self.left['start']:(self.right['end'])
-        ]
-        self.amplicon_inner = self.amplicon[
-            self.left['length']:(-1 * self.right['length'])
+        self.penalty = float(data['PAIR_PENALTY'])
+        left_start, left_length = [int(x) for x in data['LEFT'].split(',')]
+        right_3p, right_length = [int(x) for x in data['RIGHT'].split(',')]
+        self.left = Primer(
+            data,
+            'LEFT',
+            left_start,
+            left_start + left_length,
+            left_length,
+        )
+        self.right = Primer(
+            data,
+            'RIGHT',
+            right_3p + 2 - right_length,
+            right_3p + 1,
+            right_length,
+        )
+        self.complement_any_th = float(data['PAIR_COMPL_ANY_TH'])
+        self.complement_end_th = float(data['PAIR_COMPL_END_TH'])
+        self.amplicon_bp = int(data['PAIR_PRODUCT_SIZE'])
+        self.off_targets = None
+        if probes is None:
+            probes = self.get_probes()
+        self.probes = probes
+
+    @property
+    def amplicon(self):
+        """Return the amplicon sequence."""
+        return self.query.sequence[self.left.start:self.right.end]
+
+    @property
+    def amplicon_inner(self):
+        """Return the amplicon sequence between the primers."""
+        return self.query.sequence[
+            self.left.end:(self.right.end - self.right.length)
         ]
-        self.probes = self.get_probes()
 
     def get_probes(self):
-        """Match assay to UPL probes."""
+        """Match assay to probe sites indexed on the query template."""
         def get_distance(probe):
             """Return probe distance."""
             return probe['distance']
 
-        def get_probe_distance(self, probe):
-            """Return the minimum distance of probe from amplicon 5' or 3'."""
-            inner_start = self.amplicon_inner.find(probe)
-            inner_end = inner_start + len(probe)
-            return min([
-                inner_start,
-                len(self.amplicon_inner) - inner_end
-            ])
-
-        def reverse_complement(sequence):
-            """Return reverse complement of sequence."""
-            return ''.join([
-                COMPLEMENT[nt] for nt in sequence[::-1].upper()
-            ])
-
         probes = []
-
-        for probe_ix, probe_seq in settings.UPL_PROBES.items():
-            for probe in [probe_seq, reverse_complement(probe_seq)]:
-                if probe in self.amplicon_inner:
-                    self.query.assays_considered += 1
-                    probe_start = (
-                        self.left['end']
-                        + self.amplicon_inner.find(probe) + 1
-                    )
-                    distance = get_probe_distance(self, probe)
-                    if distance < settings.MIN_PROBE_DISTANCE:
-                        self.query.assays_rejected += 1
-                        continue
-                    if self.amplicon_inner.count(probe) > 1:
-                        self.query.assays_rejected += 1
-                        logger.info('Rejected assay: multiple probe sites')
-                        continue
-                    probes.append({
-                        'id': probe_ix,
-                        'sequence': probe,
-                        'start': probe_start,
-                        'end': probe_start + len(probe),
-                        'distance': distance,
-                    })
+        inner_start = self.left.end
+        inner_end = self.right.end - self.right.length
+
+        for hit in self.query.probe_sites.within(inner_start, inner_end):
+            self.query.assays_considered += 1
+            probe_start = hit.offset + 1
+            distance = min([
+                hit.offset - inner_start,
+                inner_end - (hit.offset + len(hit.sequence)),
+            ])
+            if distance < self.query.filters['probe_distance']:
+                self.query.assays_rejected += 1
+                continue
+            if hit.count > 1:
+                self.query.assays_rejected += 1
+                logger.info(
+                    'Rejected assay: multiple probe sites',
+                    extra={'sample': 'multiple-probe-sites'})
+                continue
+            probes.append({
+                'id': hit.id,
+                'sequence': hit.sequence,
+                'start': probe_start,
+                'end': probe_start + len(hit.sequence),
+                'distance': distance,
+            })
         return sorted(probes, key=get_distance, reverse=True)
 
-    def build(self):
-        """Return a list of assays generated from this build."""
-        return [
-                Assay(self, probe)
-                for probe in self.probes
-            ]
-
 
 class Assay:
     """A PCR assay describing a set of primers and a probe."""
 
-    def __init__(self, builder, probe):
+    __slots__ = ('builder', 'probe', 'score')
+
+    def __init__(self, builder, probe, score=None):
         """Create the assay from the builder template."""
+        self.builder = builder
         self.probe = probe
-        self.query = builder.query
-        self.index = builder.index
-        self.left = builder.left
-        self.right = builder.right
-        self.complement_any_th = builder.complement_any_th
-        self.complement_end_th = builder.complement_end_th
-        self.amplicon_bp = builder.amplicon_bp
-        self.amplicon = builder.amplicon
-        self.amplicon_inner = builder.amplicon_inner
+        self.score = score
+
+    query = property(lambda self: self.builder.query)
+    index = property(lambda self: self.builder.index)
+    left = property(lambda self: self.builder.left)
+    right = property(lambda self: self.builder.right)
+    complement_any_th = property(lambda self: self.builder.complement_any_th)
+    complement_end_th = property(lambda self: self.builder.complement_end_th)
+    amplicon_bp = property(lambda self: self.builder.amplicon_bp)
+    amplicon = property(lambda self: self.builder.amplicon)
+    amplicon_inner = property(lambda self: self.builder.amplicon_inner)
+    # Not set on builders pickled before specificity screening
+    off_targets = property(
+        lambda self: getattr(self.builder, 'off_targets', None))
+
+    def as_dict(self):
+        """Return assay as a JSON-serializable dict."""
+        return {
+            'index': self.index,
+            'score': self.score,
+            'probe': dict(self.probe),
+            'left': self.left.as_dict(),
+            'right': self.right.as_dict(),
+            'complement_any_th': self.complement_any_th,
+            'complement_end_th': self.complement_end_th,
+            'amplicon_bp': self.amplicon_bp,
+            'amplicon': self.amplicon,
+            'off_targets': self.off_targets,
+        }
+
+    def as_compact_list(self):
+        """Return the assay as a list for client-side rendering.
+
+        Items are the probe ID, start and sequence, then the start, end
+        and sequence of the left and right primers, as in as_dict(). The
+        amplicon is left to be sliced from the template sequence.
+        """
+        return [
+            self.probe['id'],
+            self.probe['start'],
+            self.probe['sequence'],
+            self.left.start,
+            self.left.end,
+            self.left.sequence,
+            self.right.start,
+            self.right.end,
+            self.right.sequence,
+        ]
 
     def __str__(self):
         """Return sequence alignment of the assay."""
@@ -396,13 +748,12 @@ class Assay:
         return '\n'.join([line1, line2, line3, line4])
 
 
-def clean_input_files(new_path):
-    """Clean files from directory older than 1 hour."""
-    for temp_dir in (settings.PRIMER3_INPUT_DIR, settings.PRIMER3_OUTPUT_DIR):
-        for f in os.listdir(temp_dir):
-            path = os.path.join(temp_dir, f)
-            if time.time() - os.path.getmtime(path) > 3600:
-                os.remove(path)
+def clean_output_files():
+    """Clean files from output directory older than 1 hour."""
+    for f in os.listdir(settings.PRIMER3_OUTPUT_DIR):
+        path = os.path.join(settings.PRIMER3_OUTPUT_DIR, f)
+        if time.time() - os.path.getmtime(path) > 3600:
+            os.remove(path)
 
 
 if __name__ == '__main__':
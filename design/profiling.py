@@ -0,0 +1,195 @@
+"""Profile individual requests and design jobs on demand.
+
+With settings.PROFILING enabled, staff users can ask for a request to be
+profiled with ``?profile=1`` or an ``X-Profile: 1`` header. The request
+is run under cProfile while a sampling thread records its call stacks,
+and two files are written to settings.PROFILE_DIR:
+
+- ``<name>.pstats``, for ``python -m pstats`` or snakeviz
+- ``<name>.collapsed``, folded stacks for flamegraph.pl or speedscope
+
+The profile name is returned in the ``X-Profile`` response header.
+Streamed responses are only profiled until they start. Jobs queued by a
+profiled request are profiled when a worker runs them. Sequences are
+designed serially while profiling, so that all of the work is done in the
+profiled process.
+
+Without settings.PROFILING the middleware removes itself at startup.
+"""
+
+import os
+import sys
+import time
+import uuid
+import cProfile
+import threading
+import contextvars
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.text import slugify
+
+import logging
+logger = logging.getLogger('django')
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+_active = contextvars.ContextVar('profiling', default=False)
+
+
+def active():
+    """Return True if the current request or job is being profiled."""
+    return _active.get()
+
+
+class StackSampler:
+    """Count the call stacks of a thread, sampled at an interval."""
+
+    def __init__(self, thread_id, interval):
+        """Create sampler for the thread with the given ident."""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """Start sampling."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to exit."""
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """Record a stack sample every interval until stopped."""
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f'{code.co_name} ({os.path.basename(code.co_filename)}'
+                    f':{code.co_firstlineno})'
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write the stacks in the collapsed format of flamegraph.pl."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def profile_name(label):
+    """Return a unique, sortable profile name for label."""
+    return '-'.join([
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        slugify(label)[:40],
+        uuid.uuid4().hex[:8],
+    ])
+
+
+@contextmanager
+def profile(label):
+    """Profile the enclosed code and yield the profile name.
+
+    Nothing is done when already profiling, since a thread can only run
+    one profiler. The name is then None.
+    """
+    if active():
+        yield None
+        return
+    name = profile_name(label)
+    token = _active.set(True)
+    profiler = cProfile.Profile()
+    sampler = StackSampler(
+        threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    profiler.enable()
+    try:
+        yield name
+    finally:
+        profiler.disable()
+        sampler.stop()
+        _active.reset(token)
+        save(name, profiler, sampler)
+
+
+def save(name, profiler, sampler):
+    """Write profile artifacts and enforce the retention limits."""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILE_DIR, name)
+    try:
+        profiler.dump_stats(path + '.pstats')
+        sampler.write(path + '.collapsed')
+    except OSError as exc:
+        logger.warning(f'Failed to write profile {name}: {exc}')
+        return
+    logger.info(f'Wrote profile {name}')
+    clean_profiles()
+
+
+def clean_profiles():
+    """Delete expired profiles, then the oldest beyond PROFILE_MAX_COUNT."""
+    profiles = {}
+    for f in os.listdir(settings.PROFILE_DIR):
+        name, _ = os.path.splitext(f)
+        profiles.setdefault(name, []).append(
+            os.path.join(settings.PROFILE_DIR, f))
+    expired = time.time() - settings.PROFILE_RETENTION
+    # Names start with their timestamp, so they sort oldest first
+    names = sorted(profiles)
+    excess = len(names) - settings.PROFILE_MAX_COUNT
+    for i, name in enumerate(names):
+        try:
+            if i < excess or all(
+                os.path.getmtime(path) < expired
+                for path in profiles[name]
+            ):
+                for path in profiles[name]:
+                    os.remove(path)
+        except OSError:
+            # Removed by another process
+            continue
+
+
+def requested(request):
+    """Return True if a staff user asked for the request to be profiled."""
+    flag = (
+        request.GET.get('profile')
+        or request.META.get(PROFILE_HEADER)
+    )
+    if flag not in ('1', 'true'):
+        return False
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+class ProfilingMiddleware:
+    """Profile requests that ask for it, when settings.PROFILING is on.
+
+    Must follow AuthenticationMiddleware, so that staff can be identified.
+    """
+
+    def __init__(self, get_response):
+        """Remove the middleware unless profiling is enabled."""
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Run the request under the profiler if requested."""
+        if not requested(request):
+            return self.get_response(request)
+        label = f"{request.method} {request.path.strip('/') or 'index'}"
+        with profile(label) as name:
+            response = self.get_response(request)
+        if name:
+            response['X-Profile'] = name
+        return response
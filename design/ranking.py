@@ -0,0 +1,95 @@
+"""Rank candidate assays and keep only the best few.
+
+Each (primer pair, probe) combination is scored as it is generated, lower
+scores being better. Only the top ``assays_per_probe`` candidates for each
+probe are held, in bounded heaps, and of those only the overall top
+settings.ASSAYS_PER_SEQUENCE are kept, so that memory and the number of
+Assay objects built grow with these limits rather than with the number of
+pairs and probe sites.
+
+The scoring function is configured by dotted path in
+settings.ASSAY_SCORER and is called as ``score(builder, probe)`` with the
+AssayBuilder of the primer pair and a probe dict from its get_probes().
+"""
+
+import heapq
+import itertools
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Weights of the terms of the default score
+PENALTY_WEIGHT = 1.0
+TM_MISMATCH_WEIGHT = 1.0
+CENTRALITY_WEIGHT = 2.0
+OFF_TARGET_WEIGHT = 5.0
+
+
+def default_score(builder, probe):
+    """Score an assay from pair penalty, Tm mismatch and probe centrality.
+
+    Centrality is the offset of the probe from the middle of the inner
+    amplicon as a fraction of its half-length, from 0 (central) to 1.
+    Pairs screened for specificity are also penalized for each predicted
+    off-target amplicon.
+    """
+    tm_mismatch = abs(builder.left.tm - builder.right.tm)
+    inner_start = builder.left.end
+    inner_end = builder.right.end - builder.right.length
+    half = max((inner_end - inner_start) / 2, 1)
+    middle = inner_start + half
+    probe_middle = probe['start'] - 1 + len(probe['sequence']) / 2
+    centrality = min(abs(probe_middle - middle) / half, 1)
+    return (
+        PENALTY_WEIGHT * builder.penalty
+        + TM_MISMATCH_WEIGHT * tm_mismatch
+        + CENTRALITY_WEIGHT * centrality
+        + OFF_TARGET_WEIGHT * (builder.off_targets or 0)
+    )
+
+
+_scorers = {}
+
+
+def get_scorer(path=None):
+    """Return the configured scoring function."""
+    path = path or settings.ASSAY_SCORER
+    if path not in _scorers:
+        _scorers[path] = import_string(path)
+    return _scorers[path]
+
+
+class Ranker:
+    """Bounded top-k selection of candidate assays."""
+
+    def __init__(self, per_probe, limit=None, score=None):
+        """Keep per_probe candidates for each probe and limit overall."""
+        self.per_probe = per_probe
+        self.limit = limit
+        self.score = score or get_scorer()
+        self.heaps = {}
+        # Breaks score ties in the order candidates were offered
+        self.counter = itertools.count()
+
+    def offer(self, builder, probe):
+        """Consider a candidate, dropping it if it can not make the cut."""
+        score = self.score(builder, probe)
+        # Max-heap on score, so the worst kept candidate is at the root
+        entry = (-score, -next(self.counter), builder, probe)
+        heap = self.heaps.setdefault(probe['id'], [])
+        if len(heap) < self.per_probe:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+
+    def ranked(self):
+        """Return (score, builder, probe) of kept candidates, best first."""
+        entries = (
+            entry
+            for heap in self.heaps.values()
+            for entry in heap
+        )
+        if self.limit:
+            best = heapq.nlargest(self.limit, entries, key=lambda e: e[:2])
+        else:
+            best = sorted(entries, key=lambda e: e[:2], reverse=True)
+        return [(-score, builder, probe) for score, _, builder, probe in best]
@@ -0,0 +1,152 @@
+"""Direct the primer3 search to regions that can flank a probe site.
+
+An assay is only reported if its inner amplicon holds a probe site at
+least ``probe_distance`` from either primer, so primer pairs elsewhere on
+the template are discarded after primer3 has spent time on them. From the
+probe sites found on the template, this module derives the left and right
+primer regions that can flank each site within the maximum amplicon size
+and passes them to primer3 as SEQUENCE_PRIMER_PAIR_OK_REGION_LIST.
+PrimerDesign.plan() asks for the regions of a distance of 0, the widest,
+so that the same primer3 records serve every probe distance.
+
+In probe-targeted mode, nearby sites are instead clustered and each
+cluster becomes a primer3 record of its own, with SEQUENCE_TARGET forcing
+the amplicon to span the cluster plus the required clearance.
+"""
+
+# Maximum number of intervals accepted by primer3 in a region list
+MAX_REGIONS = 200
+
+REGION_TAG = 'SEQUENCE_PRIMER_PAIR_OK_REGION_LIST'
+
+
+def site_regions(spans, length, params, distance):
+    """Return [left_start, left_end, right_start, right_end] per site.
+
+    The left primer must end at least distance before the site and the
+    right primer must start at least distance after it, while the amplicon
+    spans no more than amplicon_max. Sites that cannot be flanked by
+    primers of primer_min length are skipped.
+    """
+    amplicon_max = params['amplicon_max']
+    primer_min = params['primer_min']
+    regions = []
+    for start, end in spans:
+        left_start = max(0, end + distance + primer_min - amplicon_max)
+        left_end = start - distance
+        right_start = end + distance
+        right_end = min(length, left_end - primer_min + amplicon_max)
+        if left_end - left_start < primer_min:
+            continue
+        if right_end - right_start < primer_min:
+            continue
+        regions.append([left_start, left_end, right_start, right_end])
+    return regions
+
+
+def merged(regions, limit=MAX_REGIONS):
+    """Return regions merged where the left regions of sites overlap.
+
+    If more than limit regions remain, the closest neighbours are merged
+    until the list fits. Merging only widens the regions, so no assay that
+    would pass probe matching is excluded.
+    """
+    out = []
+    for region in sorted(regions):
+        if out and region[0] <= out[-1][1]:
+            last = out[-1]
+            last[1] = max(last[1], region[1])
+            last[2] = min(last[2], region[2])
+            last[3] = max(last[3], region[3])
+        else:
+            out.append(list(region))
+
+    excess = len(out) - limit
+    if excess > 0:
+        gaps = sorted(
+            range(1, len(out)),
+            key=lambda i: out[i][0] - out[i - 1][1],
+        )
+        joined = set(gaps[:excess])
+        squeezed = []
+        for i, region in enumerate(out):
+            if i in joined:
+                last = squeezed[-1]
+                last[1] = max(last[1], region[1])
+                last[2] = min(last[2], region[2])
+                last[3] = max(last[3], region[3])
+            else:
+                squeezed.append(region)
+        out = squeezed
+    return out
+
+
+def format_regions(regions):
+    """Return regions in primer3 "start,length,start,length ; ..." format."""
+    return ' ; '.join(
+        f'{ls},{le - ls},{rs},{re - rs}'
+        for ls, le, rs, re in regions
+    )
+
+
+def restrict(tags, probe_sites, params, distance):
+    """Return tags restricted to the primer regions around probe sites.
+
+    Returns None if no assay with a usable probe site can be designed on
+    the template, in which case primer3 need not be run at all.
+    """
+    regions = site_regions(
+        probe_sites.spans(),
+        len(tags['SEQUENCE_TEMPLATE']),
+        params,
+        distance,
+    )
+    if not regions:
+        return None
+    return dict(tags, **{REGION_TAG: format_regions(merged(regions))})
+
+
+def clusters(spans, params, distance):
+    """Return (start, end) targets spanning clusters of nearby sites.
+
+    Sites are joined while their clearance regions overlap and the target
+    can still be flanked by primers within the maximum amplicon size.
+    """
+    longest = params['amplicon_max'] - 2 * params['primer_min']
+    targets = []
+    for start, end in sorted(spans):
+        start, end = start - distance, end + distance
+        if targets and start <= targets[-1][1]:
+            merged_end = max(targets[-1][1], end)
+            if merged_end - targets[-1][0] <= longest:
+                targets[-1][1] = merged_end
+                continue
+        if end - start <= longest:
+            targets.append([start, end])
+    return targets
+
+
+def target(tags, probe_sites, params, distance, num_return):
+    """Return an (offset, tags) primer3 record per probe site cluster.
+
+    Each record holds only the part of the template that an amplicon
+    spanning the cluster could cover.
+    """
+    template = tags['SEQUENCE_TEMPLATE']
+    reach = params['amplicon_max'] - params['primer_min']
+    records = []
+    for start, end in clusters(probe_sites.spans(), params, distance):
+        if start < params['primer_min']:
+            continue
+        if end > len(template) - params['primer_min']:
+            continue
+        first = max(0, end - reach)
+        last = min(len(template), start + reach)
+        records.append((first, dict(
+            tags,
+            SEQUENCE_ID=f"{tags['SEQUENCE_ID']}:{first + 1}-{last}",
+            SEQUENCE_TEMPLATE=template[first:last],
+            SEQUENCE_TARGET=f'{start - first},{end - start}',
+            PRIMER_NUM_RETURN=num_return,
+        )))
+    return records
@@ -0,0 +1,322 @@
+"""Screen primer pairs for off-target amplicons in a reference genome.
+
+A reference FASTA is indexed once by ``python manage.py
+build_specificity_index`` into a directory holding:
+
+- ``sequence.bin``, the genome as one byte per base (A, C, G, T as 0-3,
+  anything else 4), with a 4 between contigs
+- ``offsets.bin``, the start of each seed's positions in positions.bin,
+  for every seed of settings.SPECIFICITY_SEED_LENGTH bases
+- ``positions.bin``, the sorted genome positions of each seed
+- ``index.json``, the seed length, position type and contigs
+
+All three arrays are memory-mapped, so the genome is never read into
+memory and pages are shared between processes.
+
+A primer binds where its 3' seed matches exactly and the rest of it has at
+most settings.SPECIFICITY_MAX_MISMATCHES mismatches. Sites on the plus
+strand are found from the primer's seed, and sites on the minus strand
+from the reverse complement of its seed. Any plus strand site followed on
+the same contig by a minus strand site, within
+settings.SPECIFICITY_MAX_AMPLICON, is a predicted amplicon. The intended
+amplicon, with both primers matching exactly at the expected product size,
+is not counted as off-target.
+
+NumPy is required for screening. Without it, or without
+settings.SPECIFICITY_INDEX, assays are not screened.
+"""
+
+import os
+import gzip
+import json
+import functools
+from django.conf import settings
+
+from .matcher import reverse_complement
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger('django')
+
+# Code of bases other than A, C, G and T, and of contig separators
+UNKNOWN = 4
+ENCODE = bytes(
+    'ACGT'.index(chr(i).upper()) if chr(i) in 'ACGTacgt' else UNKNOWN
+    for i in range(256)
+)
+
+# Off-target counts are capped, and primers with more seed hits than
+# settings.SPECIFICITY_MAX_SEED_HITS are given the cap
+MAX_OFF_TARGETS = 10
+
+# Bases of k-mers encoded at once while building the index
+BUILD_CHUNK = 1 << 24
+
+# Primers and primer pairs screened per process are cached
+SITE_CACHE_SIZE = 16384
+PAIR_CACHE_SIZE = 16384
+
+
+def enabled():
+    """Return True if assays should be screened."""
+    return np is not None and bool(settings.SPECIFICITY_INDEX)
+
+
+def encode(sequence):
+    """Return a sequence as an array of base codes."""
+    return np.frombuffer(
+        sequence.encode('ascii').translate(ENCODE), dtype=np.uint8)
+
+
+def read_fasta(path):
+    """Yield (name, line) of the sequence lines of a FASTA file.
+
+    The file may be gzipped.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    name = None
+    with opener(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                name = line[1:].split(maxsplit=1)[0].decode()
+                yield name, None
+            elif name is not None:
+                yield name, line.strip()
+
+
+def seed_codes(window, k):
+    """Return the codes of the k-mers of window and a mask of valid ones.
+
+    K-mers holding an unknown base are not valid.
+    """
+    n = len(window) - k + 1
+    codes = np.zeros(n, dtype=np.int64)
+    for t in range(k):
+        codes <<= 2
+        codes |= window[t:t + n] & 3
+    unknown = np.concatenate(
+        ([0], np.cumsum(window == UNKNOWN, dtype=np.int64)))
+    valid = unknown[k:k + n] == unknown[:n]
+    return codes, valid
+
+
+def build_index(fasta, path, seed_length=None):
+    """Index the genome of a FASTA file into directory path.
+
+    Positions are counted per seed in a first pass over the genome and
+    written in place in a second, so that memory use depends on the
+    number of seeds rather than the size of the genome.
+    """
+    if np is None:
+        raise RuntimeError('NumPy is required to build a specificity index')
+    k = seed_length or settings.SPECIFICITY_SEED_LENGTH
+    os.makedirs(path, exist_ok=True)
+
+    contigs = []
+    size = 0
+    with open(os.path.join(path, 'sequence.bin'), 'wb') as f:
+        for name, line in read_fasta(fasta):
+            if line is None:
+                if contigs:
+                    f.write(bytes([UNKNOWN]))
+                    size += 1
+                contigs.append([name, size, 0])
+                continue
+            f.write(line.translate(ENCODE))
+            size += len(line)
+            contigs[-1][2] += len(line)
+    if not size:
+        raise ValueError(f'No sequences found in {fasta}')
+    logger.info(f'Indexing {len(contigs)} contigs, {size} nt')
+
+    sequence = np.memmap(
+        os.path.join(path, 'sequence.bin'), dtype=np.uint8, mode='r')
+    position_type = np.uint32 if size < 2 ** 32 else np.uint64
+
+    def chunks():
+        """Yield (start, codes, valid) of the seeds of the genome."""
+        for start in range(0, max(size - k + 1, 0), BUILD_CHUNK):
+            window = sequence[start:start + BUILD_CHUNK + k - 1]
+            codes, valid = seed_codes(np.asarray(window), k)
+            yield start, codes, valid
+
+    counts = np.zeros(4 ** k, dtype=np.int64)
+    for _, codes, valid in chunks():
+        counts += np.bincount(codes[valid], minlength=4 ** k)
+    offsets = np.memmap(
+        os.path.join(path, 'offsets.bin'),
+        dtype=np.int64, mode='w+', shape=(4 ** k + 1,))
+    offsets[0] = 0
+    np.cumsum(counts, out=offsets[1:])
+    total = int(offsets[-1])
+
+    positions = np.memmap(
+        os.path.join(path, 'positions.bin'),
+        dtype=position_type, mode='w+', shape=(max(total, 1),))
+    cursor = np.array(offsets[:-1])
+    for start, codes, valid in chunks():
+        at = np.flatnonzero(valid)
+        codes = codes[at]
+        # Stable, so positions stay sorted within each seed
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        seeds, first, seen = np.unique(
+            codes, return_index=True, return_counts=True)
+        rank = np.arange(len(codes)) - np.repeat(first, seen)
+        positions[cursor[codes] + rank] = at[order] + start
+        cursor[seeds] += seen
+    positions.flush()
+    offsets.flush()
+
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({
+            'seed_length': k,
+            'position_type': np.dtype(position_type).name,
+            'size': size,
+            'contigs': contigs,
+        }, f)
+    logger.info(f'Indexed {total} seeds of {k} nt to {path}')
+    return total
+
+
+class GenomeIndex:
+    """A memory-mapped seed index of a reference genome."""
+
+    def __init__(self, path):
+        """Open the index in directory path."""
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.seed_length = meta['seed_length']
+        self.contigs = meta['contigs']
+        self.sequence = np.memmap(
+            os.path.join(path, 'sequence.bin'), dtype=np.uint8, mode='r')
+        self.offsets = np.memmap(
+            os.path.join(path, 'offsets.bin'), dtype=np.int64, mode='r')
+        self.positions = np.memmap(
+            os.path.join(path, 'positions.bin'),
+            dtype=np.dtype(meta['position_type']), mode='r')
+        self.contig_starts = np.array(
+            [start for _, start, _ in self.contigs], dtype=np.int64)
+        self.contig_ends = np.array(
+            [start + length for _, start, length in self.contigs],
+            dtype=np.int64)
+        self.sites = functools.lru_cache(SITE_CACHE_SIZE)(self.find_sites)
+        self.off_targets = functools.lru_cache(PAIR_CACHE_SIZE)(
+            self.count_off_targets)
+
+    def seed_positions(self, seed):
+        """Return the genome positions of a seed, or None if too many."""
+        codes = encode(seed)
+        if len(codes) < self.seed_length or (codes == UNKNOWN).any():
+            return np.zeros(0, dtype=np.int64)
+        code = 0
+        for base in codes.tolist():
+            code = code << 2 | base
+        lo, hi = self.offsets[code], self.offsets[code + 1]
+        if hi - lo > settings.SPECIFICITY_MAX_SEED_HITS:
+            return None
+        return self.positions[lo:hi].astype(np.int64)
+
+    def matching(self, starts, rest):
+        """Return starts at which rest matches, and their mismatches."""
+        starts = starts[
+            (starts >= 0) & (starts + len(rest) <= len(self.sequence))]
+        window = self.sequence[starts[:, None] + np.arange(len(rest))]
+        mismatches = (window != rest).sum(axis=1)
+        ok = (
+            (mismatches <= settings.SPECIFICITY_MAX_MISMATCHES)
+            & ~(window == UNKNOWN).any(axis=1)
+        )
+        return starts[ok], mismatches[ok]
+
+    def find_sites(self, primer):
+        """Return binding sites of a primer, or None if it is repetitive.
+
+        Sites are (plus, plus_exact, minus, minus_exact), where plus are
+        the starts of sites on the plus strand, minus the starts of sites
+        on the minus strand, and the exact masks mark perfect matches.
+        """
+        primer = primer.upper()
+        k = self.seed_length
+        length = len(primer)
+        if length < k:
+            return None
+        plus_seeds = self.seed_positions(primer[-k:])
+        rc = reverse_complement(primer)
+        minus_seeds = self.seed_positions(rc[:k])
+        if plus_seeds is None or minus_seeds is None:
+            return None
+
+        rest = encode(primer[:-k])
+        plus, plus_mismatches = self.matching(plus_seeds - len(rest), rest)
+        rest = encode(rc[k:])
+        minus, minus_mismatches = self.matching(minus_seeds + k, rest)
+        minus -= k
+        return plus, plus_mismatches == 0, minus, minus_mismatches == 0
+
+    def contig_end(self, positions):
+        """Return the end of the contig of each genome position."""
+        ix = np.searchsorted(self.contig_starts, positions, side='right') - 1
+        return self.contig_ends[ix]
+
+    def count_off_targets(self, left, right, amplicon_bp):
+        """Return the number of off-target amplicons of a primer pair.
+
+        Amplicons primed by either primer from either strand are counted,
+        up to MAX_OFF_TARGETS.
+        """
+        sites = {}
+        for primer in (left, right):
+            sites[primer] = self.find_sites(primer)
+            if sites[primer] is None:
+                return MAX_OFF_TARGETS
+
+        max_amplicon = settings.SPECIFICITY_MAX_AMPLICON
+        count = 0
+        for forward in (left, right):
+            plus = sites[forward][0]
+            if not len(plus):
+                continue
+            contig_end = self.contig_end(plus)
+            for reverse in (left, right):
+                minus = sites[reverse][2]
+                # Minus strand site must end by max_amplicon past the start
+                # of the plus strand site, on the same contig
+                last = np.minimum(plus + max_amplicon, contig_end)
+                lo = np.searchsorted(minus, plus, side='left')
+                hi = np.searchsorted(minus, last - len(reverse), side='right')
+                count += int(np.maximum(hi - lo, 0).sum())
+
+        # The intended amplicon was only counted if it is short enough
+        if amplicon_bp <= max_amplicon:
+            left_plus, left_exact = sites[left][:2]
+            right_minus, right_exact = sites[right][2:]
+            intended = np.isin(
+                left_plus[left_exact] + amplicon_bp - len(right),
+                right_minus[right_exact],
+            )
+            if intended.any():
+                count -= 1
+        return min(max(count, 0), MAX_OFF_TARGETS)
+
+
+_index = None
+
+
+def get_index():
+    """Return the index at settings.SPECIFICITY_INDEX for this process."""
+    global _index
+    if _index is None or _index.path != settings.SPECIFICITY_INDEX:
+        _index = GenomeIndex(settings.SPECIFICITY_INDEX)
+    return _index
+
+
+def off_targets(left, right, amplicon_bp):
+    """Return the off-target amplicon count of a primer pair."""
+    return get_index().off_targets(
+        left.upper(), right.upper(), amplicon_bp)
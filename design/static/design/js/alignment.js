@@ -0,0 +1,63 @@
+/*
+ * Draw primer/probe alignments in the browser from the compact result
+ * payload, as Assay.__str__ draws them on the server.
+ *
+ * Each assay is a list of [probe_id, probe_start, probe_sequence,
+ * left_start, left_end, left_sequence, right_start, right_end,
+ * right_sequence], and the template sequence is sent once per query.
+ */
+
+function spaces(n) {
+  return ' '.repeat(Math.max(n, 0));
+}
+
+function renderAlignment(sequence, assay) {
+  const [probeId, probeStart, probeSequence,
+         leftStart, leftEnd, leftSequence,
+         rightStart, rightEnd, rightSequence] = assay;
+  const probeEnd = probeStart + probeSequence.length;
+  const queryStart = Math.max(leftStart - 10, 0);
+  const queryEnd = Math.min(rightEnd + 10, sequence.length - 1);
+  const line2 = (
+    spaces(Math.min(leftStart, 10))
+    + leftSequence
+    + spaces(probeStart - leftEnd - 1)
+    + '<span class="green">' + probeSequence + '</span>'
+    + spaces(rightStart - probeEnd)
+    + rightSequence
+  );
+  const line1 = (
+    spaces(line2.indexOf(probeSequence) - 18)
+    + '<span class="green">#' + probeId + '</span>'
+  );
+  const line3 = sequence.slice(queryStart, queryEnd);
+  const line4 = (
+    String(queryStart)
+    + spaces(line3.length - String(queryEnd).length)
+    + String(queryEnd)
+  );
+  return [line1, line2, line3, line4].join('\n');
+}
+
+function renderAmplicon(sequence, assay) {
+  return sequence.slice(assay[3], assay[7]);
+}
+
+/*
+ * Fill in the amplicon and alignment of each assay element from the
+ * payload, looked up by the element's data-query and data-assay indexes.
+ */
+function renderResults(payload) {
+  const queries = {};
+  payload.queries.forEach(function(query) {
+    queries[query.number] = query;
+  });
+  document.querySelectorAll('.assay[data-query]').forEach(function(el) {
+    const query = queries[el.dataset.query];
+    const assay = query.assays[el.dataset.assay];
+    el.querySelector('.amplicon-sequence').textContent = (
+      renderAmplicon(query.sequence, assay));
+    el.querySelector('details.alignment pre').innerHTML = (
+      renderAlignment(query.sequence, assay));
+  });
+}
@@ -1,3 +1,715 @@
-from django.test import TestCase
+import io
+import os
+import json
+import logging
+import shutil
+import random
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+from primerdesign.logging.handlers import FieldsFormatter, QueuedFileHandler
 
-# Create your tests here.
+from . import (
+    boulder, matcher, regions, specificity, tiling, vectorized,
+)
+from .cache import RecordCache, cache_key
+from .fasta import ANONYMOUS, Fasta
+from .deadline import Deadline, DesignStopped
+from .benchmark import fake_primer3, suite
+from .benchmark.sequences import synthetic_sequence
+from .matcher import (
+    FORWARD, REVERSE, ProbeMatcher, ProbeSiteIndex, get_library,
+    get_matcher, reverse_complement,
+)
+from .pool import Primer3Error, Primer3Pool, Primer3Worker
+from .primer import (
+    Iteration, PrimerDesign, design_record, probe_filters, saturated,
+)
+
+
+class BoulderTests(SimpleTestCase):
+    """Records are written and read back as primer3 does."""
+
+    def test_round_trip(self):
+        tags = {
+            'SEQUENCE_ID': 'a=b',
+            'SEQUENCE_TEMPLATE': 'ACGT',
+            'PRIMER_TASK': 'generic',
+            'SEQUENCE_PRIMER_PAIR_OK_REGION_LIST': '1,10,30,10 ; 50,5,80,5',
+            'PRIMER_MIN_TM': None,
+        }
+        records = list(boulder.parse(
+            boulder.format_record(tags).splitlines(True)))
+        self.assertEqual(len(records), 1)
+        expected = {k: v for k, v in tags.items() if v is not None}
+        self.assertEqual(records[0].tags, expected)
+
+    def test_values_keep_equals_signs(self):
+        lines = [
+            'SEQUENCE_ID=x=y==\n',
+            'PRIMER_EXPLAIN_FLAG=\n',
+            'PRIMER_PAIR_EXPLAIN=considered 10, ok=3\n',
+            '=\n',
+        ]
+        record, = boulder.parse(lines)
+        self.assertEqual(record['SEQUENCE_ID'], 'x=y==')
+        self.assertEqual(record['PRIMER_EXPLAIN_FLAG'], '')
+        self.assertEqual(
+            record['PRIMER_PAIR_EXPLAIN'], 'considered 10, ok=3')
+
+    def test_records_end_at_trailing_equals(self):
+        lines = 'A=1\r\n=\r\nA=2\n=\nA=3\n'.splitlines(True)
+        records = list(boulder.parse(lines))
+        # The last record has no terminator yet, so is not complete
+        self.assertEqual([r['A'] for r in records], ['1', '2'])
+
+    def test_pair_tags_are_grouped(self):
+        lines = [
+            'PRIMER_PAIR_NUM_RETURNED=2\n',
+            'PRIMER_LEFT_0=10,20\n',
+            'PRIMER_LEFT_0_TM=60.1\n',
+            'PRIMER_RIGHT_1_SEQUENCE=ACGT\n',
+            'PRIMER_PAIR_1_PENALTY=0.5\n',
+            '=\n',
+        ]
+        record, = boulder.parse(lines)
+        self.assertEqual(record['PRIMER_PAIR_NUM_RETURNED'], '2')
+        self.assertEqual(record.pairs, [
+            {'LEFT': '10,20', 'LEFT_TM': '60.1'},
+            {'RIGHT_SEQUENCE': 'ACGT', 'PAIR_PENALTY': '0.5'},
+        ])
+        renamed = record.renamed('b')
+        self.assertEqual(renamed['SEQUENCE_ID'], 'b')
+        self.assertNotIn('SEQUENCE_ID', record)
+
+
+class FastaTests(SimpleTestCase):
+    """FASTA input is read the same from strings and files."""
+
+    def setUp(self):
+        self.sequences = {
+            'first': synthetic_sequence(250, seed=1),
+            'second': synthetic_sequence(5000, seed=2),
+            'third': '',
+        }
+
+    def read_file(self, text, chunk_size):
+        """Return a Fasta read from text as binary and text files."""
+        binary = Fasta.from_file(
+            io.BytesIO(text.encode('utf-8')), chunk_size=chunk_size)
+        fas = Fasta.from_file(io.StringIO(text), chunk_size=chunk_size)
+        self.assertEqual(dict(binary.items()), dict(fas.items()))
+        return fas
+
+    def test_round_trip(self):
+        text = str(Fasta(self.sequences))
+        self.assertEqual(
+            dict(Fasta.from_string(text).items()), self.sequences)
+        for chunk_size in (1, 7, 81, 64 * 1024):
+            fas = self.read_file(text, chunk_size)
+            self.assertEqual(dict(fas.items()), self.sequences)
+
+    def test_crlf_line_endings(self):
+        text = str(Fasta(self.sequences)).replace('\n', '\r\n') + '\r\n'
+        self.assertEqual(
+            dict(Fasta.from_string(text).items()), self.sequences)
+        # Chunks of 2 split most CRLF pairs between chunks
+        for chunk_size in (2, 3, 1000):
+            fas = self.read_file(text, chunk_size)
+            self.assertEqual(dict(fas.items()), self.sequences)
+
+    def test_long_lines(self):
+        sequence = synthetic_sequence(200000, seed=3)
+        text = f'>long one\n{sequence.lower()}\n>short\nACGT'
+        fas = self.read_file(text, 4096)
+        self.assertEqual(
+            dict(fas.items()), {'long_one': sequence, 'short': 'ACGT'})
+
+    def test_duplicate_titles_are_renamed(self):
+        text = '>a\nAC\n>a\nGT\n>a_1\nTT\n>a\nCC\n'
+        fas = Fasta.from_string(text)
+        self.assertEqual(list(fas.items()), [
+            ('a', 'AC'), ('a_1', 'GT'), ('a_1_1', 'TT'), ('a_2', 'CC'),
+        ])
+
+    def test_multibyte_titles_split_between_chunks(self):
+        text = '>séquence µ\nACGT\n'
+        fas = self.read_file(text, 1)
+        self.assertEqual(list(fas.items()), [('séquence_µ', 'ACGT')])
+
+    def test_unformatted_sequence(self):
+        fas = Fasta.from_string('acg t\nGGC\r\n')
+        self.assertEqual(list(fas.items()), [(ANONYMOUS, 'ACGTGGC')])
+
+    def test_invalid_dna(self):
+        with self.assertRaises(ValidationError) as raised:
+            Fasta.from_string('>x\nACGT\nACNT\n')
+        self.assertIn('"N" at position 7', str(raised.exception))
+
+
+class CacheKeyTests(SimpleTestCase):
+    """Records are keyed by what primer3 is asked, and nothing else."""
+
+    def setUp(self):
+        self.params = suite.design_params(
+            dict(suite.DEFAULT_OPTIONS, sequences=3))
+
+    def keys(self, **changes):
+        """Return the cache key of each record for changed params."""
+        params = dict(self.params, **changes)
+        design = PrimerDesign(params, run=False)
+        filters = probe_filters(params)
+        return [
+            cache_key(design.plan(tags, params, filters))
+            for tags in design.create_input(params)
+        ]
+
+    def test_keys_differ_per_sequence(self):
+        keys = self.keys()
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(keys, self.keys())
+
+    def test_primer3_params_change_keys(self):
+        keys = self.keys()
+        for name, value in [
+            ('tm_min', 58.0),
+            ('amplicon_max', 90),
+            ('primer_optimum', 21),
+            ('gc_clamp', 1),
+        ]:
+            changed = self.keys(**{name: value})
+            self.assertTrue(
+                all(a != b for a, b in zip(keys, changed)), name)
+
+    def test_probe_filters_and_names_keep_keys(self):
+        keys = self.keys()
+        self.assertEqual(self.keys(probe_distance=20), keys)
+        self.assertEqual(self.keys(assays_per_probe=1), keys)
+        fasta = self.params['fasta']
+        renamed = type(fasta)({
+            f'renamed {name}': sequence for name, sequence in fasta.items()
+        })
+        self.assertEqual(self.keys(fasta=renamed), keys)
+
+    @override_settings(PROBE_REGION_RESTRICTION=True)
+    def test_probe_library_changes_keys(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'probes.json')
+        probes = dict(list(get_library().items())[::2])
+        with open(path, 'w') as f:
+            json.dump(probes, f)
+        libraries = dict(settings.PROBE_LIBRARIES, half={
+            'name': 'Every other UPL probe',
+            'path': path,
+        })
+        self.addCleanup(matcher._libraries.pop, 'half', None)
+        with override_settings(PROBE_LIBRARIES=libraries):
+            changed = self.keys(probe_library='half')
+        self.assertTrue(all(a != b for a, b in zip(self.keys(), changed)))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'records': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests',
+    },
+})
+class RecordCacheTests(SimpleTestCase):
+    """The LRU tier is backed by the persistent records cache."""
+
+    def setUp(self):
+        self.cache = RecordCache(2)
+        self.addCleanup(self.cache.clear)
+
+    def test_least_recently_used_are_evicted(self):
+        for key in 'abc':
+            self.cache.set(key, key.upper())
+        self.assertEqual(list(self.cache.memory), ['b', 'c'])
+        self.assertEqual(self.cache.get('b'), 'B')
+        self.cache.set('d', 'D')
+        self.assertEqual(list(self.cache.memory), ['b', 'd'])
+
+    def test_evicted_values_are_read_from_persistent_tier(self):
+        for key in 'abc':
+            self.cache.set(key, key.upper())
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.assertEqual(list(self.cache.memory), ['c', 'a'])
+        self.assertIsNone(self.cache.get('z'))
+
+    def test_memory_tier_can_be_disabled(self):
+        cache = RecordCache(0)
+        cache.set('a', 'A')
+        self.assertEqual(cache.memory, {})
+        self.assertEqual(cache.get('a'), 'A')
+
+
+class ProbeIdTests(SimpleTestCase):
+    """Probe IDs of any library can be listed."""
+
+    def probe_ids(self, *ids):
+        """Return get_probe_ids() of an Iteration with assays of ids."""
+        query = SimpleNamespace(assays=[
+            SimpleNamespace(probe={'id': probe_id}) for probe_id in ids
+        ])
+        return Iteration.get_probe_ids(query)
+
+    def test_numeric_ids_sort_numerically(self):
+        self.assertEqual(
+            self.probe_ids('10', '9', '85', '9'), ['9', '10', '85'])
+
+    def test_other_ids_are_kept(self):
+        self.assertEqual(
+            self.probe_ids('oligo-b', '12', 'oligo-a', '3'),
+            ['3', '12', 'oligo-a', 'oligo-b'],
+        )
+
+
+def fake_design(tags):
+    """Return the Record designed for tags by the primer3 stand-in."""
+    output = fake_primer3.format_output(fake_primer3.design(tags))
+    return next(boulder.parse(output.splitlines(True)))
+
+
+class TilingTests(SimpleTestCase):
+    """Window outputs are merged back onto the full template."""
+
+    def window(self, offset, *pairs):
+        """Return an (offset, Record) output of (left, right, penalty)."""
+        return offset, boulder.Record({'SEQUENCE_ID': f'x:{offset + 1}'}, [
+            {
+                'LEFT': left,
+                'RIGHT': right,
+                'LEFT_SEQUENCE': 'ACGTA',
+                'PAIR_PENALTY': penalty,
+            }
+            for left, right, penalty in pairs
+        ])
+
+    def test_windows_hold_every_amplicon(self):
+        spans = tiling.windows(1000, 300, 100)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], 1000)
+        for start in range(0, 900):
+            self.assertTrue(any(
+                first <= start and start + 100 <= last
+                for first, last in spans
+            ), start)
+
+    def test_pairs_are_shifted_to_template(self):
+        template = synthetic_sequence(3000, seed=3, site_density=0)
+        tags = {
+            'SEQUENCE_ID': 'x',
+            'SEQUENCE_TEMPLATE': template,
+            'PRIMER_NUM_RETURN': 5,
+            'PRIMER_PRODUCT_SIZE_RANGE': '60-150',
+        }
+        outputs = [
+            (offset, fake_design(window))
+            for offset, window in tiling.tile(tags, 600, 150)
+        ]
+        self.assertGreater(len(outputs), 1)
+        merged = tiling.merge(tags, outputs)
+        self.assertGreater(len(merged.pairs), 5)
+        self.assertTrue(any(
+            int(pair['LEFT'].split(',')[0]) >= 600 for pair in merged.pairs))
+        for pair in merged.pairs:
+            start, length = map(int, pair['LEFT'].split(','))
+            self.assertEqual(
+                template[start:start + length], pair['LEFT_SEQUENCE'])
+            end, length = map(int, pair['RIGHT'].split(','))
+            self.assertEqual(
+                reverse_complement(template[end - length + 1:end + 1]),
+                pair['RIGHT_SEQUENCE'],
+            )
+
+    def test_merge_dedups_overlapping_pairs(self):
+        merged = tiling.merge({'SEQUENCE_ID': 'x', 'SEQUENCE_TEMPLATE': ''}, [
+            self.window(0, ('30,5', '60,5', '3.0'), ('5,5', '40,5', '1.0')),
+            self.window(20, ('10,5', '40,5', '3.5'), ('50,5', '90,5', '2.0')),
+        ])
+        self.assertEqual(
+            [(pair['LEFT'], pair['RIGHT']) for pair in merged.pairs],
+            [('5,5', '40,5'), ('70,5', '110,5'), ('30,5', '60,5')],
+        )
+        self.assertEqual(merged.pairs[-1]['PAIR_PENALTY'], '3.0')
+        self.assertEqual(merged['PRIMER_PAIR_NUM_RETURNED'], '3')
+
+
+class RegionTests(SimpleTestCase):
+    """Restricted regions keep every pair that can flank a probe site."""
+
+    params = {'amplicon_max': 60, 'primer_min': 5}
+    primer_max = 7
+    length = 160
+    spans = [(2, 10), (40, 48), (45, 53), (70, 78), (120, 128), (150, 158)]
+
+    def restrict(self, distance):
+        """Return (ls, le, rs, re) OK regions for sites at distance."""
+        sites = SimpleNamespace(spans=lambda: self.spans)
+        tags = regions.restrict(
+            {'SEQUENCE_TEMPLATE': 'A' * self.length},
+            sites, self.params, distance)
+        out = []
+        for interval in tags[regions.REGION_TAG].split(';'):
+            ls, ll, rs, rl = map(int, interval.split(','))
+            out.append((ls, ls + ll, rs, rs + rl))
+        return out
+
+    def valid_pairs(self, distance):
+        """Yield (ls, le, rs, re) of every pair flanking a probe site."""
+        amplicon_max = self.params['amplicon_max']
+        sizes = range(self.params['primer_min'], self.primer_max + 1)
+        for ls in range(self.length):
+            for left in sizes:
+                le = ls + left
+                for right in sizes:
+                    last = min(self.length, ls + amplicon_max)
+                    for re in range(le + right, last + 1):
+                        rs = re - right
+                        if any(
+                            start - le >= distance and rs - end >= distance
+                            for start, end in self.spans
+                        ):
+                            yield ls, le, rs, re
+
+    def assertPairsAllowed(self, pairs, allowed):
+        for ls, le, rs, re in pairs:
+            self.assertTrue(any(
+                a <= ls and le <= b and c <= rs and re <= d
+                for a, b, c, d in allowed
+            ), (ls, le, rs, re))
+
+    def test_no_valid_pair_is_excluded(self):
+        for distance in (0, 5, 12):
+            with self.subTest(distance=distance):
+                pairs = list(self.valid_pairs(distance))
+                self.assertTrue(pairs)
+                self.assertPairsAllowed(pairs, self.restrict(distance))
+                # plan() runs the regions of distance 0 for every distance
+                self.assertPairsAllowed(pairs, self.restrict(0))
+
+    def test_squeezed_regions_exclude_no_pair(self):
+        distance = 5
+        found = regions.site_regions(
+            self.spans, self.length, self.params, distance)
+        pairs = list(self.valid_pairs(distance))
+        for limit in range(1, len(found)):
+            with self.subTest(limit=limit):
+                squeezed = regions.merged(found, limit)
+                self.assertLessEqual(len(squeezed), limit)
+                self.assertPairsAllowed(pairs, squeezed)
+
+    def test_unflankable_sites_skip_primer3(self):
+        sites = SimpleNamespace(spans=lambda: [(2, 10), (150, 158)])
+        tags = {'SEQUENCE_TEMPLATE': 'A' * self.length}
+        self.assertIsNone(regions.restrict(tags, sites, self.params, 0))
+
+
+class DeepeningTests(SimpleTestCase):
+    """Tiled records are asked for more pairs while any window is full."""
+
+    def window(self, num_returned):
+        """Return a window output Record holding num_returned pairs."""
+        return boulder.Record({
+            'SEQUENCE_ID': 'x:1',
+            'PRIMER_PAIR_NUM_RETURNED': str(num_returned),
+        })
+
+    def test_window_counts_decide(self):
+        tags = {'SEQUENCE_ID': 'x', 'SEQUENCE_TEMPLATE': ''}
+        merged = tiling.merge(
+            tags, [(0, self.window(20)), (10, self.window(3))])
+        self.assertEqual(merged['PRIMER_PAIR_NUM_RETURNED'], '0')
+        self.assertTrue(saturated(merged, 20))
+        merged = tiling.merge(
+            tags, [(0, self.window(19)), (10, self.window(3))])
+        self.assertFalse(saturated(merged, 20))
+        self.assertTrue(saturated(self.window(20), 20))
+        self.assertFalse(saturated(tiling.merge(tags, []), 20))
+
+    def test_overlapping_windows_go_deeper(self):
+        template = synthetic_sequence(3000, seed=5, site_density=0)
+        tags = {'SEQUENCE_ID': 'x', 'SEQUENCE_TEMPLATE': template}
+        plan = tiling.tile(tags, 2000, 1000)
+        asked = []
+
+        def run_plan(tags, plan, debug_file=None, deadline=None):
+            # Both windows find the same pairs, in the overlap at 1000-2000
+            num_return = plan[0][1]['PRIMER_NUM_RETURN']
+            asked.append(num_return)
+            overlap = fake_design({
+                'SEQUENCE_ID': 'overlap',
+                'SEQUENCE_TEMPLATE': template[1000:2000],
+                'PRIMER_NUM_RETURN': num_return,
+                'PRIMER_PRODUCT_SIZE_RANGE': '60-150',
+            })
+            self.assertEqual(len(overlap.pairs), num_return)
+            return tiling.merge(tags, [
+                (offset, boulder.Record(overlap.tags, [
+                    tiling.shifted(pair, 1000 - offset)
+                    for pair in overlap.pairs
+                ]))
+                for offset, _ in plan
+            ])
+
+        with mock.patch('design.primer.run_plan', run_plan), \
+                mock.patch('design.primer.cache.records', RecordCache(0)), \
+                override_settings(CACHES=dict(settings.CACHES, records={
+                    'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+                })):
+            record, iteration = design_record(
+                (tags, plan, [2, 4, 8]), probe_filters({}))
+        self.assertEqual(asked, [2, 4, 8])
+        self.assertEqual(record['PRIMER_PAIR_NUM_RETURNED'], '8')
+
+
+@override_settings(PRIMER3_PATH=suite.FAKE_PRIMER3_PATH)
+class Primer3PoolTests(SimpleTestCase):
+    """Workers that fail to start do not use up the pool."""
+
+    record = {'SEQUENCE_ID': 'a', 'SEQUENCE_TEMPLATE': 'ACGT' * 50}
+
+    def setUp(self):
+        self.pool = Primer3Pool(2)
+        self.addCleanup(self.pool.close)
+
+    def run_record(self, deadline=None):
+        """Return the output record of a pool run."""
+        return list(self.pool.run([self.record], deadline=deadline))[0]
+
+    def test_failed_spawn_frees_its_slot(self):
+        command = mock.patch.object(
+            Primer3Worker, 'command', return_value=['/nonexistent/primer3'])
+        with command:
+            for _ in range(3):
+                with self.assertRaises(Primer3Error):
+                    self.run_record()
+        self.assertEqual(self.pool.started, 0)
+        record = self.run_record(Deadline(5))
+        self.assertEqual(record['SEQUENCE_ID'], 'a')
+        self.assertIsNone(record.get('PRIMER_ERROR'))
+
+    def test_failed_restart_returns_the_worker(self):
+        self.run_record()
+        self.pool.idle.queue[0].stop()
+        command = mock.patch.object(
+            Primer3Worker, 'command', return_value=['/nonexistent/primer3'])
+        with command, self.assertRaises(Primer3Error):
+            self.run_record()
+        self.assertEqual(self.pool.idle.qsize(), 1)
+        self.assertIsNone(self.run_record().get('PRIMER_ERROR'))
+
+    def test_waiting_for_a_worker_checks_the_deadline(self):
+        pool = Primer3Pool(1)
+        self.addCleanup(pool.close)
+        with pool.acquire():
+            with self.assertRaises(DesignStopped):
+                list(pool.run([self.record], deadline=Deadline(1)))
+
+
+def baseline_sites(probes, sequence):
+    """Return probe sites as found by str.find() and str.count().
+
+    This is how probes were matched to amplicons before the matcher, one
+    probe and strand at a time: (id, strand, sequence, offset, count) of
+    the first site of each, in library order.
+    """
+    sites = []
+    for probe_id, probe_seq in probes.items():
+        for strand, probe in [
+            (FORWARD, probe_seq),
+            (REVERSE, reverse_complement(probe_seq)),
+        ]:
+            if probe in sequence:
+                sites.append((
+                    probe_id,
+                    strand,
+                    probe,
+                    sequence.find(probe),
+                    sequence.count(probe),
+                ))
+    return sites
+
+
+class ProbeMatcherTests(SimpleTestCase):
+    """The matcher finds the sites str.find() and str.count() find."""
+
+    def setUp(self):
+        self.probes = get_library()
+        self.matcher = get_matcher(self.probes)
+        self.sequences = [
+            synthetic_sequence(2000, seed, site_density=10)
+            for seed in range(5)
+        ]
+
+    def test_scan_finds_every_site(self):
+        for sequence in self.sequences:
+            found = sorted(self.matcher.scan(sequence))
+            expected = []
+            for ix, (_, _, probe) in enumerate(self.matcher.patterns):
+                offset = sequence.find(probe)
+                while offset != -1:
+                    expected.append((ix, offset))
+                    offset = sequence.find(probe, offset + 1)
+            self.assertEqual(found, sorted(expected))
+
+    def test_overlapping_patterns(self):
+        matcher = ProbeMatcher({'1': 'AAAA', '2': 'AAAAAA', '3': 'ACGT'})
+        sequence = 'AAAAAAAACGTT'
+        found = sorted(
+            (matcher.patterns[ix][2], offset)
+            for ix, offset in matcher.scan(sequence)
+        )
+        expected = sorted(
+            (probe, offset)
+            for _, _, probe in matcher.patterns
+            for offset in range(len(sequence))
+            if sequence.startswith(probe, offset)
+        )
+        self.assertEqual(found, expected)
+
+    def test_within_matches_baseline(self):
+        rnd = random.Random(0)
+        for sequence in self.sequences:
+            index = ProbeSiteIndex(self.matcher, sequence)
+            for _ in range(200):
+                start = rnd.randrange(len(sequence))
+                end = rnd.randint(start, min(start + 150, len(sequence)))
+                hits = [
+                    (hit.id, hit.strand, hit.sequence,
+                     hit.offset - start, hit.count)
+                    for hit in index.within(start, end)
+                ]
+                self.assertEqual(
+                    hits,
+                    baseline_sites(self.probes, sequence[start:end]),
+                )
+
+    def test_within_counts_non_overlapping_sites(self):
+        matcher = ProbeMatcher({'1': 'AAAA'})
+        sequence = 'C' + 'A' * 9 + 'C'
+        index = ProbeSiteIndex(matcher, sequence)
+        for start, end in [(0, 11), (1, 10), (2, 9), (3, 7), (5, 8)]:
+            hits = [
+                (hit.id, hit.strand, hit.sequence,
+                 hit.offset - start, hit.count)
+                for hit in index.within(start, end)
+            ]
+            self.assertEqual(
+                hits,
+                baseline_sites(matcher.probes, sequence[start:end]),
+            )
+
+
+@unittest.skipIf(vectorized.np is None, 'NumPy is not installed')
+class VectorizedMatchingTests(SimpleTestCase):
+    """The NumPy path gives the same assays as the scalar path."""
+
+    def design(self, filters):
+        """Return the as_dict() of each record on both paths."""
+        lines = self.output.splitlines(True)
+        results = {}
+        for enabled in (False, True):
+            with override_settings(VECTORIZED_MATCHING=enabled):
+                results[enabled] = [
+                    Iteration(record, filters).as_dict()
+                    for record in boulder.parse(lines)
+                ]
+        return results[False], results[True]
+
+    def setUp(self):
+        options = dict(suite.DEFAULT_OPTIONS, sequences=5, site_density=4)
+        self.output = suite.output_text(options)
+
+    def test_default_filters(self):
+        scalar, fast = self.design(probe_filters({}))
+        self.assertTrue(any(result['assays'] for result in scalar))
+        self.assertEqual(scalar, fast)
+
+    def test_probe_distance_and_assays_per_probe(self):
+        for distance, per_probe in [(0, 1), (5, 2), (20, 5)]:
+            filters = probe_filters({
+                'probe_distance': distance,
+                'assays_per_probe': per_probe,
+            })
+            scalar, fast = self.design(filters)
+            self.assertEqual(scalar, fast)
+
+
+@unittest.skipIf(specificity.np is None, 'NumPy is not installed')
+@override_settings(SPECIFICITY_MAX_AMPLICON=500)
+class OffTargetTests(SimpleTestCase):
+    """Primer pairs are screened against an indexed genome."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.template = synthetic_sequence(3000, seed=1, site_density=0)
+        self.left = self.template[100:120]
+
+    def index(self, *contigs):
+        """Return an index of a genome of the given contigs."""
+        fasta = os.path.join(self.directory, 'genome.fa')
+        with open(fasta, 'w') as f:
+            for i, contig in enumerate(contigs):
+                f.write(f'>contig_{i + 1}\n{contig}\n')
+        specificity.build_index(fasta, self.directory)
+        return specificity.GenomeIndex(self.directory)
+
+    def pair(self, amplicon_bp):
+        """Return (left, right, amplicon_bp) of a pair on the template."""
+        end = 100 + amplicon_bp
+        right = reverse_complement(self.template[end - 20:end])
+        return self.left, right, amplicon_bp
+
+    def test_intended_amplicon_is_not_counted(self):
+        index = self.index(self.template)
+        self.assertEqual(index.count_off_targets(*self.pair(300)), 0)
+
+    def test_long_intended_amplicon_is_not_subtracted(self):
+        index = self.index(self.template)
+        self.assertEqual(index.count_off_targets(*self.pair(1000)), 0)
+
+    def test_second_copy_is_counted(self):
+        copy = self.template[:600]
+        index = self.index(self.template, copy)
+        self.assertEqual(index.count_off_targets(*self.pair(300)), 1)
+        self.assertEqual(index.count_off_targets(*self.pair(1000)), 0)
+
+
+class QueuedFileHandlerTests(SimpleTestCase):
+    """Records dropped from a full queue are counted in the log."""
+
+    def test_next_record_notes_dropped_records(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'main.log')
+        handler = QueuedFileHandler(path, capacity=1)
+        handler.setFormatter(FieldsFormatter('{message}', style='{'))
+        # Without a listener, the queue fills after the first record
+        handler.listener.stop()
+        records = [
+            logging.makeLogRecord({'msg': msg, 'levelno': logging.INFO})
+            for msg in 'abcde'
+        ]
+        for record in records[:3]:
+            handler.handle(record)
+        self.assertEqual(handler.dropped, 2)
+
+        handler.capacity = 10
+        handler.start()
+        for record in records[3:]:
+            handler.handle(record)
+        handler.close()
+        self.assertEqual(handler.dropped, 0)
+        self.assertFalse(hasattr(records[3], 'dropped'))
+        with open(path) as f:
+            self.assertEqual(f.read(), 'd dropped=2\ne\n')
@@ -0,0 +1,111 @@
+"""Split long templates into overlapping windows for primer3.
+
+Each window is designed as a separate primer3 record. Windows overlap by
+the maximum amplicon size, so any amplicon that fits in the template fits
+entirely inside at least one window. The output records are then mapped
+back onto the full template and merged into a single record.
+"""
+
+from . import boulder
+
+# Tags holding "start,length" coordinates of a primer in each pair
+COORDINATE_TAGS = ('LEFT', 'RIGHT', 'INTERNAL')
+
+# Tag of a merged record holding the pairs returned by each window, as
+# "n,n,...", before pairs found in more than one window were merged
+WINDOW_COUNTS_TAG = 'WINDOW_PAIR_NUM_RETURNED'
+
+
+def windows(length, size, overlap):
+    """Return (start, end) windows covering a sequence of the given length."""
+    if length <= size:
+        return [(0, length)]
+    step = size - overlap
+    spans = []
+    start = 0
+    while True:
+        end = min(start + size, length)
+        spans.append((start, end))
+        if end == length:
+            return spans
+        start += step
+
+
+def window_size(params, size):
+    """Return window size for the target parameters.
+
+    The window is kept large relative to the overlap, so that tiling does
+    not mostly re-design the same overlapping regions.
+    """
+    return max(size, 4 * params['amplicon_max'])
+
+
+def tile(tags, size, overlap):
+    """Return (offset, tags) records for each window of an input record."""
+    template = tags['SEQUENCE_TEMPLATE']
+    return [
+        (start, dict(
+            tags,
+            SEQUENCE_ID=f"{tags['SEQUENCE_ID']}:{start + 1}-{end}",
+            SEQUENCE_TEMPLATE=template[start:end],
+        ))
+        for start, end in windows(len(template), size, overlap)
+    ]
+
+
+def shifted(pair, offset):
+    """Return a pair with primer coordinates moved by offset."""
+    pair = dict(pair)
+    for tag in COORDINATE_TAGS:
+        if tag in pair:
+            position, length = pair[tag].split(',')
+            pair[tag] = f'{int(position) + offset},{length}'
+    return pair
+
+
+def merge(tags, outputs):
+    """Merge (offset, Record) window outputs into one record for tags.
+
+    Pairs are mapped onto the full template, de-duplicated where windows
+    overlap and ordered by pair penalty, as primer3 would order them. The
+    number of pairs each window returned is kept in WINDOW_COUNTS_TAG.
+    """
+    pairs = {}
+    counts = []
+    errors = []
+    explain = {'PAIR': [], 'LEFT': [], 'RIGHT': []}
+    for offset, record in outputs:
+        if record.get('PRIMER_ERROR'):
+            errors.append(f"{record['SEQUENCE_ID']}: {record['PRIMER_ERROR']}")
+            continue
+        counts.append(record.get('PRIMER_PAIR_NUM_RETURNED', '0'))
+        for side in explain:
+            value = record.get(f'PRIMER_{side}_EXPLAIN')
+            if value:
+                explain[side].append(value)
+        for pair in record.pairs:
+            if not pair.get('LEFT_SEQUENCE'):
+                continue
+            pair = shifted(pair, offset)
+            pairs.setdefault((pair['LEFT'], pair['RIGHT']), pair)
+
+    pairs = sorted(
+        pairs.values(),
+        key=lambda pair: float(pair.get('PAIR_PENALTY', 0)),
+    )
+    merged = boulder.Record({
+        'SEQUENCE_ID': tags['SEQUENCE_ID'],
+        'SEQUENCE_TEMPLATE': tags['SEQUENCE_TEMPLATE'],
+        'PRIMER_LEFT_NUM_RETURNED': str(len(pairs)),
+        'PRIMER_RIGHT_NUM_RETURNED': str(len(pairs)),
+        'PRIMER_INTERNAL_NUM_RETURNED': '0',
+        'PRIMER_PAIR_NUM_RETURNED': str(len(pairs)),
+        WINDOW_COUNTS_TAG: ','.join(counts),
+    }, pairs)
+    for side, values in explain.items():
+        merged.tags[f'PRIMER_{side}_EXPLAIN'] = '; '.join(values)
+    if errors and len(errors) == len(outputs):
+        merged.tags['PRIMER_ERROR'] = errors[0]
+    elif errors:
+        merged.tags['PRIMER_WARNING'] = '; '.join(errors)
+    return merged
@@ -0,0 +1,187 @@
+"""Match primer pairs to probe sites with batched NumPy array operations.
+
+This is an optional fast path for the per-pair probe matching done by
+AssayBuilder.get_probes(). The coordinates of all pairs of an Iteration
+are loaded into arrays and matched against the sorted site offsets of
+each probe in turn, so that containment, clearance and uniqueness checks
+run once per probe rather than once per pair. With the default scorer,
+candidates are also scored as arrays and only the top ``per_probe`` for
+each probe are passed on to ranking, after screening them for specificity
+when that is enabled. Counters, scores and the order of candidates are
+identical to the scalar path.
+
+NumPy is not a requirement of the app. Without it, or with
+settings.VECTORIZED_MATCHING disabled, the scalar path is used.
+"""
+
+from django.conf import settings
+
+from . import ranking, specificity
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import logging
+logger = logging.getLogger('django')
+
+
+def enabled():
+    """Return True if the vectorized path should be used."""
+    return np is not None and settings.VECTORIZED_MATCHING
+
+
+def column(pairs, key, dtype=float):
+    """Return a pair tag of all pairs as an array."""
+    return np.array([pair[key] for pair in pairs], dtype=dtype)
+
+
+def coordinates(pairs, key):
+    """Return arrays of the "position,length" values of a pair tag."""
+    values = np.array(
+        [pair[key].split(',') for pair in pairs], dtype=np.int64,
+    ).reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def default_scores(pairs, pair_ix, offsets, lengths, inner_start, inner_end):
+    """Return ranking.default_score() of candidates as an array."""
+    penalty = column(pairs, 'PAIR_PENALTY')[pair_ix]
+    tm_mismatch = np.abs(
+        column(pairs, 'LEFT_TM')[pair_ix]
+        - column(pairs, 'RIGHT_TM')[pair_ix]
+    )
+    inner_start = inner_start[pair_ix]
+    half = np.maximum((inner_end[pair_ix] - inner_start) / 2, 1)
+    middle = inner_start + half
+    probe_middle = offsets + lengths / 2
+    centrality = np.minimum(np.abs(probe_middle - middle) / half, 1)
+    return (
+        ranking.PENALTY_WEIGHT * penalty
+        + ranking.TM_MISMATCH_WEIGHT * tm_mismatch
+        + ranking.CENTRALITY_WEIGHT * centrality
+    )
+
+
+def off_target_counts(pairs, pair_ix):
+    """Return the off-target amplicon counts of pairs as an array."""
+    counts = {
+        i: specificity.off_targets(
+            pairs[i]['LEFT_SEQUENCE'],
+            pairs[i]['RIGHT_SEQUENCE'],
+            int(pairs[i]['PAIR_PRODUCT_SIZE']),
+        )
+        for i in np.unique(pair_ix).tolist()
+    }
+    return np.array([counts[i] for i in pair_ix.tolist()], dtype=float)
+
+
+def top_per_group(groups, scores, k):
+    """Return mask of the k lowest scores per group, ties by position."""
+    order = np.lexsort((np.arange(len(scores)), scores, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(
+        np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    rank = np.arange(len(order)) - np.repeat(starts, sizes)
+    keep = np.zeros(len(scores), dtype=bool)
+    keep[order[rank < k]] = True
+    return keep
+
+
+def match_probes(query, pairs, per_probe=None):
+    """Return {pair index: probes} for pairs with acceptable probe sites.
+
+    Probes are dicts as returned by AssayBuilder.get_probes(), in the same
+    order. The considered and rejected counters of the query Iteration are
+    updated as the scalar path would update them. If per_probe is given
+    and the default scorer is configured, only candidates that can make
+    the top per_probe of their probe are returned.
+    """
+    if not pairs:
+        return {}
+    left_start, left_length = coordinates(pairs, 'LEFT')
+    right_3p, right_length = coordinates(pairs, 'RIGHT')
+    inner_start = left_start + left_length
+    inner_end = right_3p + 1 - right_length
+    index = query.probe_sites
+    patterns = index.matcher.patterns
+    min_distance = query.filters['probe_distance']
+
+    matches = []
+    considered = rejected = multiple = 0
+    for ix in sorted(index.sites):
+        sites = np.array(index.sites[ix], dtype=np.int64)
+        length = len(patterns[ix][2])
+        last_offset = inner_end - length
+        lo = np.searchsorted(sites, inner_start, side='left')
+        hi = np.searchsorted(sites, last_offset, side='right')
+        first = sites[np.minimum(lo, len(sites) - 1)]
+        present = (lo < len(sites)) & (first <= last_offset)
+        if not present.any():
+            continue
+        last = sites[np.maximum(hi - 1, 0)]
+        distance = np.minimum(first - inner_start, last_offset - first)
+        close = distance < min_distance
+        repeated = ~close & (last >= first + length)
+        accepted = np.flatnonzero(present & ~close & ~repeated)
+
+        considered += int(present.sum())
+        rejected += int((present & close).sum())
+        multiple += int((present & repeated).sum())
+        matches.append((
+            accepted,
+            distance[accepted],
+            np.full(len(accepted), ix),
+            first[accepted],
+        ))
+
+    query.assays_considered += considered
+    query.assays_rejected += rejected + multiple
+    if multiple:
+        logger.info(
+            'Rejected %d assays: multiple probe sites', multiple,
+            extra={'sample': 'multiple-probe-sites'})
+    if not matches:
+        return {}
+
+    pair_ix, distance, pattern_ix, offsets = [
+        np.concatenate(values) for values in zip(*matches)
+    ]
+    # Pairs in primer3 order, then probes by distance as get_probes() does
+    order = np.lexsort((pattern_ix, -distance, pair_ix))
+    pair_ix, distance, pattern_ix, offsets = (
+        pair_ix[order], distance[order], pattern_ix[order], offsets[order])
+
+    if per_probe and ranking.get_scorer() is ranking.default_score:
+        lengths = np.array([len(p[2]) for p in patterns])[pattern_ix]
+        probe_ids = {}
+        groups = np.array([
+            probe_ids.setdefault(patterns[ix][0], len(probe_ids))
+            for ix in pattern_ix.tolist()
+        ])
+        scores = default_scores(
+            pairs, pair_ix, offsets, lengths, inner_start, inner_end)
+        if specificity.enabled():
+            scores += ranking.OFF_TARGET_WEIGHT * off_target_counts(
+                pairs, pair_ix)
+        keep = top_per_group(groups, scores, per_probe)
+        pair_ix, distance, pattern_ix, offsets = (
+            pair_ix[keep], distance[keep], pattern_ix[keep], offsets[keep])
+
+    probes = {}
+    for i, d, ix, offset in zip(
+            pair_ix.tolist(),
+            distance.tolist(),
+            pattern_ix.tolist(),
+            offsets.tolist()):
+        probe_id, _, sequence = patterns[ix]
+        probes.setdefault(i, []).append({
+            'id': probe_id,
+            'sequence': sequence,
+            'start': offset + 1,
+            'end': offset + 1 + len(sequence),
+            'distance': d,
+        })
+    return probes
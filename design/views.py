@@ -1,10 +1,24 @@
 """Provide user interface for requesting primer design analysis."""
 
+import hmac
+import json
+import time
 import pprint
-from django.shortcuts import render
 from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse)
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_POST
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from . import metrics, specificity
 from .primer import PrimerDesign
 from .forms import PrimerForm
+from .models import Job, Result
+from .deadline import Deadline, DesignStopped
 
 import logging
 logger = logging.getLogger('django')
@@ -13,15 +27,18 @@ logger = logging.getLogger('django')
 def index(request):
     """Collect user input and run primer design prediction."""
     if request.method == "POST":
-        form = PrimerForm(request.POST)
+        form = PrimerForm(request.POST, request.FILES)
         if form.is_valid():
-            result = PrimerDesign(form.cleaned_data)
-            logger.info(
-                f"Assay Design returned {len(result)} results"
-                f" with {result.total_assay_count} assays:\n{result}")
-            return render(request, 'design/result.html', {
-                'result': result
-            })
+            if settings.DESIGN_ASYNC:
+                job = Job.submit(form.cleaned_data)
+                logger.info('Design queued', extra={'fields': {
+                    'job': job.id,
+                    'sequences': job.query_count,
+                }})
+                return redirect('job', job_id=job.id)
+            # Job.run logs a summary of the run
+            job = Job.run_inline(form.cleaned_data)
+            return redirect('job', job_id=job.id)
         if settings.PRIMER3_DEBUG:
             logger.info('Form was not validated')
             logger.info('Form errors:\n'
@@ -31,3 +48,192 @@ def index(request):
 
     form = PrimerForm()
     return render(request, 'design/index.html', {'form': form})
+
+
+def job(request, job_id):
+    """Show the status of a design job, or its result when done."""
+    job = get_object_or_404(Job, pk=job_id)
+    if job.status in Job.HAS_RESULTS and job.results.exists():
+        return render_result(request, job)
+    return render(request, 'design/job.html', {
+        'job': job,
+        'refresh': settings.JOB_POLL_INTERVAL * 2,
+    })
+
+
+@require_POST
+def cancel_job(request, job_id):
+    """Cancel a queued or running design job."""
+    job = get_object_or_404(Job, pk=job_id)
+    job.cancel()
+    logger.info(f"Cancel requested for design job {job.id}")
+    return redirect('job', job_id=job.id)
+
+
+# Result pages hold no CSRF token or other secrets to leak by compression
+@gzip_page
+def render_result(request, job):
+    """Render a page of the query sequence results of a finished job.
+
+    Only the results on the requested page are loaded. With
+    settings.RESULT_CLIENT_RENDERING, amplicons and primer/probe
+    alignments are drawn in the browser from a compact JSON payload.
+    Otherwise alignments are fetched separately when shown. With
+    ``?format=json`` only the payload is returned.
+    """
+    paginator = Paginator(job.results.all(), settings.RESULT_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+    queries = [result.load() for result in page]
+    payload = {
+        'page': page.number,
+        'num_pages': paginator.num_pages,
+        'queries': [
+            dict(query.as_compact_dict(), number=query.number)
+            for query in queries
+        ],
+    }
+    if request.GET.get('format') == 'json':
+        with metrics.timed('render'):
+            return JsonResponse(payload)
+    with metrics.timed('render'):
+        return render(request, 'design/result.html', {
+            'job': job,
+            'page': page,
+            'queries': queries,
+            'query_pages': [
+                (i + 1, i // settings.RESULT_PAGE_SIZE + 1)
+                for i in range(paginator.count)
+            ],
+            'client_rendering': settings.RESULT_CLIENT_RENDERING,
+            'max_off_targets': specificity.MAX_OFF_TARGETS,
+            'payload': payload if settings.RESULT_CLIENT_RENDERING else None,
+        })
+
+
+def assay_alignment(request, job_id, index, assay):
+    """Return the primer/probe alignment of an assay as an HTML fragment."""
+    result = get_object_or_404(Result, job_id=job_id, index=index)
+    assays = result.load().assays
+    if not 0 <= assay < len(assays):
+        raise Http404('No such assay')
+    return HttpResponse(str(assays[assay]))
+
+
+def job_status(request, job_id):
+    """Return the status of a design job as JSON for polling clients."""
+    job = get_object_or_404(Job, pk=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'position': job.position(),
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+        'error': job.error,
+        'result_url': (
+            reverse('job', kwargs={'job_id': job.id})
+            if job.status in Job.HAS_RESULTS else None
+        ),
+        'cancel_url': (
+            reverse('cancel_job', kwargs={'job_id': job.id})
+            if not job.is_finished else None
+        ),
+    })
+
+
+@csrf_exempt
+@require_POST
+def api_design(request):
+    """Design assays for a batch of sequences and stream results as NDJSON.
+
+    The request body is a JSON object with either ``fasta`` (a FASTA
+    string) or ``sequences`` (a list of {"name", "sequence"} objects), and
+    either ``params`` (an object of form fields) or ``parameter_sets`` (a
+    list of them). Omitted form fields take their default values.
+
+    One line is streamed per sequence and parameter set as soon as it has
+    been designed. If the run passes settings.DESIGN_DEADLINE, a final
+    line with ``error`` and ``stopped`` is streamed instead of the rest.
+    Design work stops when the client disconnects.
+    """
+    try:
+        body = json.loads(request.body)
+        fasta = body.get('fasta') or ''.join(
+            f'>{x["name"]}\n{x["sequence"]}\n'
+            for x in body['sequences']
+        )
+        parameter_sets = body.get('parameter_sets') or [
+            body.get('params', {})]
+        parameter_sets = [dict(x) for x in parameter_sets]
+    except (ValueError, KeyError, TypeError, AttributeError) as exc:
+        return JsonResponse({'error': f'Invalid request: {exc}'}, status=400)
+
+    defaults = {
+        name: field.initial
+        for name, field in PrimerForm.base_fields.items()
+        if field.initial is not None
+    }
+    params = []
+    errors = {}
+    for i, parameter_set in enumerate(parameter_sets):
+        data = dict(defaults)
+        data.update(parameter_set)
+        data['fasta'] = fasta
+        form = PrimerForm(data)
+        if form.is_valid():
+            params.append(form.cleaned_data)
+        else:
+            errors[i] = form.errors
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    deadline = Deadline(settings.DESIGN_DEADLINE)
+
+    def results():
+        start = time.monotonic()
+        summary = {
+            'parameter_sets': len(params),
+            'sequences': 0,
+            'assays': 0,
+            'stopped': '',
+        }
+        try:
+            for i, cleaned_data in enumerate(params):
+                design = PrimerDesign(
+                    cleaned_data, run=False, deadline=deadline)
+                for j, iteration in enumerate(design.stream(cleaned_data)):
+                    summary['sequences'] += 1
+                    summary['assays'] += len(iteration.assays)
+                    line = dict(iteration.as_dict(), parameter_set=i, index=j)
+                    yield json.dumps(line) + '\n'
+        except DesignStopped as exc:
+            summary['stopped'] = exc.reason
+            yield json.dumps({'error': str(exc), 'stopped': exc.reason}) + '\n'
+        finally:
+            summary['seconds'] = time.monotonic() - start
+            logger.info('Batch design finished', extra={'fields': summary})
+
+    return StreamingHttpResponse(
+        results(),
+        content_type='application/x-ndjson',
+    )
+
+
+@never_cache
+def metrics_view(request):
+    """Return design metrics in the Prometheus text format.
+
+    Only served to requests with an ``Authorization: Bearer`` header
+    holding settings.METRICS_TOKEN. Metrics of jobs finished by design
+    workers are added first.
+    """
+    token = settings.METRICS_TOKEN
+    given = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(
+            given.encode(), f'Bearer {token}'.encode()):
+        raise Http404
+    Job.report_metrics()
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -2,6 +2,13 @@
 
 workers = 1
 
+# Serve requests from threads, so that long design runs and streamed batch
+# API responses do not block other users. The worker heartbeat runs apart
+# from request threads, but keep the timeout above DESIGN_DEADLINE anyway.
+worker_class = "gthread"
+threads = 8
+timeout = 660
+
 # Environment variables
 raw_env = [
     "DJANGO_SETTINGS_MODULE=primerdesign.production"
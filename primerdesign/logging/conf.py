@@ -13,10 +13,19 @@ LOGGING = {
     'disable_existing_loggers': False,
     'formatters': {
         'simple': {
+            '()': 'primerdesign.logging.handlers.FieldsFormatter',
             'format': '{levelname} {message}',
             'style': '{',
         },
     },
+    'filters': {
+        # Per-event messages logged with extra={'sample': key}
+        'rate_limit': {
+            '()': 'primerdesign.logging.handlers.RateLimitFilter',
+            'burst': 5,
+            'interval': 60,
+        },
+    },
     'handlers': {
         'console': {
             'level': 'INFO',
@@ -25,7 +34,7 @@ LOGGING = {
         },
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'primerdesign.logging.handlers.QueuedFileHandler',
             'filename': logfile,
             'formatter': 'simple',
         },
@@ -33,6 +42,7 @@ LOGGING = {
     'loggers': {
         'django': {
             'handlers': ['console', 'file'],
+            'filters': ['rate_limit'],
             'propagate': True,
         },
     }
@@ -0,0 +1,165 @@
+"""Logging handlers, filters and formatters that keep requests fast.
+
+Records are handed to a background thread through a queue, so that
+formatting and disk writes happen outside of the request. Messages logged
+per event are rate-limited, and summaries are logged as a message plus
+``extra={'fields': {...}}``, which are rendered as key=value pairs.
+"""
+
+import os
+import copy
+import time
+import queue
+import atexit
+import threading
+import logging
+import logging.handlers
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """Queue listener that can be stopped while its queue is full."""
+
+    def enqueue_sentinel(self):
+        """Wait for the thread to make room for the sentinel."""
+        self.queue.put(self._sentinel)
+
+
+class QueuedFileHandler(logging.handlers.QueueHandler):
+    """Write records to a file from a background thread.
+
+    Records are queued unformatted, and formatted by the listener thread.
+    When the queue is full, records are dropped and counted rather than
+    blocking the caller, and the next record queued notes how many. A new
+    listener is started in forked children, since the parent's thread is
+    not copied to them.
+
+    Server processes and design workers all append to the same file, so
+    none of them rotates it. Rotate it with logrotate instead: the file is
+    reopened once it has been moved away.
+    """
+
+    def __init__(self, filename, capacity=10000, encoding='utf-8'):
+        """Create the file handler and start the listener."""
+        self.target = logging.handlers.WatchedFileHandler(
+            filename,
+            encoding=encoding,
+            delay=True,
+        )
+        self.capacity = capacity
+        self.dropped = 0
+        self.inherited_stream = None
+        super().__init__(None)
+        self.listener = None
+        self.start()
+        atexit.register(self.stop)
+
+    def start(self):
+        """Start a listener for this process."""
+        self.pid = os.getpid()
+        self.queue = queue.Queue(self.capacity)
+        self.listener = QueueListener(
+            self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Write out queued records and stop the listener."""
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def setFormatter(self, fmt):
+        """Format with fmt in the listener thread."""
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """Queue the record as it is, leaving formatting to the listener."""
+        return record
+
+    def enqueue(self, record):
+        """Queue a record, or drop it if the queue is full."""
+        if self.pid != os.getpid():
+            # The parent's listener may have been part way through a write.
+            # Reopen the file, and keep the copied stream from being
+            # flushed again when it is garbage collected.
+            self.inherited_stream = self.target.stream
+            self.target.stream = None
+            self.start()
+        if self.dropped:
+            # Other handlers are passed the same record
+            record = copy.copy(record)
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+    def close(self):
+        """Stop the listener and close the file."""
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most burst records per sample key per interval.
+
+    Only records logged with ``extra={'sample': key}`` are limited. The
+    first record let through after some were dropped notes how many.
+    """
+
+    def __init__(self, burst=5, interval=60):
+        """Create filter passing burst records per interval seconds."""
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        """Return True if the record should be logged."""
+        key = getattr(record, 'sample', None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            start, passed, dropped = self.windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, passed = now, 0
+            if passed >= self.burst:
+                self.windows[key] = (start, passed, dropped + 1)
+                return False
+            self.windows[key] = (start, passed + 1, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class FieldsFormatter(logging.Formatter):
+    """Append ``fields`` and dropped record counts as key=value pairs."""
+
+    def format(self, record):
+        """Return the formatted record."""
+        message = super().format(record)
+        fields = dict(getattr(record, 'fields', None) or {})
+        if getattr(record, 'suppressed', None):
+            fields['suppressed'] = record.suppressed
+        if getattr(record, 'dropped', None):
+            fields['dropped'] = record.dropped
+        if fields:
+            message += ' ' + ' '.join(
+                f'{key}={format_value(value)}'
+                for key, value in fields.items()
+            )
+        return message
+
+
+def format_value(value):
+    """Return value for a key=value pair, quoted if it has spaces."""
+    if isinstance(value, float):
+        return f'{value:.3f}'
+    value = str(value)
+    if not value or ' ' in value or '"' in value:
+        return '"' + value.replace('"', '\\"') + '"'
+    return value
@@ -7,9 +7,14 @@ from .settings import *
 
 DEBUG = False
 PRIMER3_DEBUG = False   # Additional logging and file output
+DESIGN_ASYNC = True     # Requires `python manage.py design_worker`
 
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
     'primers.neoformit.com',
 ]
+
+# Console output is written synchronously by request threads, so only the
+# queued log file is kept in production
+LOGGING['loggers']['django']['handlers'] = ['file']
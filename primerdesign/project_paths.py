@@ -19,17 +19,27 @@ PRIMER3_CONFIG_PATH = os.path.join(
     'src',
     'primer3_config'
 )
-PRIMER3_INPUT_DIR = os.path.join(
+PRIMER3_OUTPUT_DIR = os.path.join(
     BASE_DIR,
     'design',
     'primer3',
-    'input_files'
+    'output_files'
 )
-PRIMER3_OUTPUT_DIR = os.path.join(
+PROFILE_DIR = os.path.join(
     BASE_DIR,
     'design',
     'primer3',
-    'output_files'
+    'profiles'
+)
+RECORD_CACHE_DIR = os.path.join(
+    BASE_DIR,
+    'design',
+    'primer3',
+    'cache'
+)
+BENCHMARK_DIR = os.path.join(
+    BASE_DIR,
+    'benchmarks'
 )
 PROBE_SEQUENCE_PATH = os.path.join(
     BASE_DIR,
@@ -39,12 +49,11 @@ PROBE_SEQUENCE_PATH = os.path.join(
 )
 PATHS = [
     ('PRIMER3_PATH', PRIMER3_PATH),
-    ('PRIMER3_INPUT_DIR', PRIMER3_INPUT_DIR),
     ('PRIMER3_OUTPUT_DIR', PRIMER3_OUTPUT_DIR),
     ('PROBE_SEQUENCE_PATH', PROBE_SEQUENCE_PATH),
 ]
 
-for DIR in (PRIMER3_INPUT_DIR, PRIMER3_OUTPUT_DIR):
+for DIR in (PRIMER3_OUTPUT_DIR,):
     if not os.path.exists(DIR):
         try:
             os.mkdir(DIR)
@@ -20,10 +20,127 @@ from .project_paths import *
 # Minimum nt distance between probe and primers
 MIN_PROBE_DISTANCE = 8
 
+# Number of long-lived primer3 processes per server process
+PRIMER3_POOL_SIZE = 2
+
+# Seconds a primer3 process may sit idle before it is pinged on checkout
+PRIMER3_POOL_HEALTH_INTERVAL = 60
+
+# Seconds primer3 may spend on a single record before it is killed and the
+# record reported as failed
+PRIMER3_RECORD_TIMEOUT = 120
+
+# Seconds a design run may take before it is stopped with partial results
+DESIGN_DEADLINE = 600
+
+# Number of processes used to design multi-sequence jobs in parallel
+PRIMER3_PARALLELISM = min(os.cpu_count() or 1, 4)
+
+# Only let primer3 search for primers that can flank a probe site
+PROBE_REGION_RESTRICTION = True
+
+# PRIMER_NUM_RETURN values tried in turn for each record, until probe
+# matching yields PRIMER3_ASSAY_QUOTA assays or primer3 runs out of pairs
+PRIMER3_NUM_RETURN_STEPS = (20, 100, 500)
+PRIMER3_ASSAY_QUOTA = 10
+
+# Pairs returned per probe site cluster in probe-targeted design mode
+PROBE_TARGET_NUM_RETURN = 5
+
+# Window size (nt) used to tile long sequences when tiling is requested.
+# Windows are at least 4x the maximum amplicon size and overlap by it.
+TILING_WINDOW = 5000
+
+# Number of primer3 output records held in memory by each server process
+RECORD_CACHE_SIZE = 256
+
+# Maximum number of assays reported per probe for each sequence
+ASSAYS_PER_PROBE = 5
+
+# Match primer pairs to probe sites with NumPy, when it is installed
+VECTORIZED_MATCHING = True
+
+# Maximum number of ranked assays kept for each sequence
+ASSAYS_PER_SEQUENCE = 50
+
+# Dotted path to the function that scores assays for ranking, lowest first
+ASSAY_SCORER = 'design.ranking.default_score'
+
+# Directory of a reference genome index built by
+# `python manage.py build_specificity_index`. Assays are screened for
+# off-target amplicons in the genome when this is set and NumPy is
+# installed.
+SPECIFICITY_INDEX = None
+
+# Bases at the 3' end of primers that must match a binding site exactly.
+# Only used when building an index.
+SPECIFICITY_SEED_LENGTH = 12
+
+# Mismatches allowed in the rest of a primer at a binding site
+SPECIFICITY_MAX_MISMATCHES = 2
+
+# Largest off-target amplicon (nt) that is counted
+SPECIFICITY_MAX_AMPLICON = 3000
+
+# Primers whose seed occurs more often than this are treated as repetitive
+SPECIFICITY_MAX_SEED_HITS = 20000
+
+# Number of query sequences shown per page of a result
+RESULT_PAGE_SIZE = 10
+
+# Draw assay alignments in the browser from a compact JSON payload, rather
+# than fetching server-rendered alignments when they are opened
+RESULT_CLIENT_RENDERING = True
+
+# Let staff profile a request with ?profile=1 or an "X-Profile: 1" header.
+# Profiles are written to PROFILE_DIR.
+PROFILING = False
+
+# Seconds between call stack samples of a profiled request
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Seconds to keep profiles, and the most profiles to keep
+PROFILE_RETENTION = 7 * 24 * 3600
+PROFILE_MAX_COUNT = 100
+
+# Queue design runs as background jobs instead of running them in the
+# request. Jobs are run by `python manage.py design_worker`.
+DESIGN_ASYNC = False
+
+# Number of jobs each design_worker runs at once
+JOB_CONCURRENCY = 2
+
+# Seconds between polls of an empty job queue
+JOB_POLL_INTERVAL = 1
+
+# Priority of jobs submitted through the form. Higher runs first.
+JOB_DEFAULT_PRIORITY = 0
+
+# Seconds to keep finished jobs and their results
+JOB_RETENTION = 24 * 3600
+
+# Seconds past DESIGN_DEADLINE after which a running job is taken to have
+# lost its worker, and failed
+JOB_STALE_MARGIN = 300
+
+# Seconds between clean ups of stale and expired jobs by requests that run
+# designs inline, when DESIGN_ASYNC is off
+JOB_CLEAN_UP_INTERVAL = 600
+
 # UPL probe sequences
 with open(PROBE_SEQUENCE_PATH) as f:
     UPL_PROBES = json.load(f)
 
+# Probe libraries that can be selected for matching. Each is a JSON file of
+# {probe_id: sequence}.
+PROBE_LIBRARIES = {
+    'upl': {
+        'name': 'Roche UPL',
+        'path': PROBE_SEQUENCE_PATH,
+    },
+}
+DEFAULT_PROBE_LIBRARY = 'upl'
+
 # General config
 DEBUG = True
 PRIMER3_DEBUG = False
@@ -34,6 +151,9 @@ ALLOWED_HOSTS = [
     '127.0.0.1',
 ]
 
+# Bearer token required to read /metrics, which is not served without one
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 
 # Application definition
 INSTALLED_APPS = [
@@ -48,11 +168,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'design.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'design.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -85,10 +207,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Design workers write to the job queue concurrently
+            'timeout': 20,
+        },
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Primer3 output records per sequence and primer3 parameters
+    'records': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': RECORD_CACHE_DIR,
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -20,4 +20,14 @@ from design import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index),
+    path('job/<uuid:job_id>/', views.job, name='job'),
+    path('job/<uuid:job_id>/status/', views.job_status, name='job_status'),
+    path('job/<uuid:job_id>/cancel/', views.cancel_job, name='cancel_job'),
+    path(
+        'job/<uuid:job_id>/query/<int:index>/assay/<int:assay>/',
+        views.assay_alignment,
+        name='assay_alignment',
+    ),
+    path('api/design/', views.api_design, name='api_design'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]